@@ -0,0 +1,178 @@
+#!/bin/python3
+#
+# Copyright International Business Machines Corp, 2022
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Scale benchmark of the LSF executor against the fake LSF cluster in ../simulator.
+# Airflow must be installed. Options of the executor are set by AIRFLOW__LSF__* variables, e.g.
+#
+#   AIRFLOW__LSF__BULK_SUBMIT=True python3 bench_executor.py --jobs 100 1000 10000 50000
+#
+# --overhead measures the cost of one call of each LSF transport instead:
+#
+#   python3 bench_executor.py --overhead --calls 100
+
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+
+TOP = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(TOP, 'lsf_executor'))
+os.environ['PATH'] = os.path.join(TOP, 'simulator') + os.pathsep + os.environ['PATH']
+
+from airflow.models.taskinstance import TaskInstanceKey
+from airflow.utils.state import State
+
+import lsf
+
+COMMAND = ['airflow', 'tasks', 'run', 'bench', 'task', 'bench_run', '--local']
+
+# counts every subprocess started by the executor
+subprocesses = 0
+popen_init = subprocess.Popen.__init__
+
+def counted_popen_init(self, *args, **kwargs):
+    global subprocesses
+    subprocesses += 1
+    popen_init(self, *args, **kwargs)
+
+subprocess.Popen.__init__ = counted_popen_init
+
+
+def heartbeat(executor, durations):
+    start = time.monotonic()
+    executor.sync()
+    durations.append(time.monotonic() - start)
+
+    finished = 0
+    for state, _ in executor.get_event_buffer().values():
+        if state in (State.SUCCESS, State.FAILED):
+            finished += 1
+    return finished
+
+def run(jobs, args):
+    global subprocesses
+
+    fd, state = tempfile.mkstemp(prefix='lsfsim-', suffix='.db')
+    os.close(fd)
+    os.environ['LSF_SIM_STATE'] = state
+
+    executor = lsf.LSFExecutor()
+    executor.start()
+
+    keys = [TaskInstanceKey(dag_id='bench', task_id=f'task_{i}', run_id='bench_run', try_number=1) for i in range(jobs)]
+
+    subprocesses = 0
+    durations = []
+    finished = 0
+    tracemalloc.start()
+    start = time.monotonic()
+
+    # the scheduler hands at most `parallelism` tasks to the executor in one heartbeat
+    for i in range(0, jobs, args.parallelism):
+        for key in keys[i:i + args.parallelism]:
+            executor.running.add(key)
+            executor.execute_async(key, COMMAND)
+        finished += heartbeat(executor, durations)
+
+    while finished < jobs and time.monotonic() - start < args.timeout:
+        time.sleep(args.interval)
+        finished += heartbeat(executor, durations)
+
+    elapsed = time.monotonic() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    executor.end()
+    os.unlink(state)
+
+    durations.sort()
+    return {
+        'jobs': jobs,
+        'finished': finished,
+        'seconds': elapsed,
+        'subprocesses': subprocesses,
+        'heartbeats': len(durations),
+        'mean_ms': sum(durations) / len(durations) * 1000,
+        'p95_ms': durations[int(len(durations) * 0.95)] * 1000,
+        'max_ms': durations[-1] * 1000,
+        'peak_mb': peak / (1 << 20),
+    }
+
+
+def overhead(args):
+    # the simulator is used by the cli transport, pythonlsf needs a real cluster
+    fd, state = tempfile.mkstemp(prefix='lsfsim-', suffix='.db')
+    os.close(fd)
+    os.environ['LSF_SIM_STATE'] = state
+
+    log = logging.getLogger('bench')
+    names = ['cli', 'fake'] + (['pythonlsf'] if lsf.lsfapi is not None else [])
+    request = (['-J', 'bench'], COMMAND)
+
+    print(''.join(f'{c:>14}' for c in ['transport', 'submit_ms', 'status_ms', 'kill_ms']))
+    for name in names:
+        transport = lsf.make_transport(name, log, 30)
+        timings = []
+        for call in (lambda: transport.submit([request]),
+                lambda: transport.status(jobids),
+                lambda: transport.kill(jobids[:1])):
+            start = time.monotonic()
+            for _ in range(args.calls):
+                result = call()
+            timings.append((time.monotonic() - start) / args.calls * 1000)
+            if len(timings) == 1:
+                jobids = result
+
+        print(f'{name:>14}' + ''.join(f'{t:>14.3f}' for t in timings))
+
+    os.unlink(state)
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark LSF executor against the LSF simulator')
+    parser.add_argument('--jobs', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--parallelism', type=int, default=1000, help='tasks handed to the executor per heartbeat')
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between heartbeats')
+    parser.add_argument('--timeout', type=float, default=600, help='seconds to wait for all jobs')
+    parser.add_argument('--run-time', type=float, default=5, help='average seconds a job runs')
+    parser.add_argument('--pend-time', type=float, default=1, help='average seconds a job pends')
+    parser.add_argument('--latency', type=float, default=0, help='seconds each LSF command takes')
+    parser.add_argument('--failure-rate', type=float, default=0, help='fraction of jobs which fail')
+    parser.add_argument('--overhead', action='store_true', help='measure the cost of one call of each LSF transport')
+    parser.add_argument('--calls', type=int, default=100, help='calls of each operation with --overhead')
+    args = parser.parse_args()
+
+    os.environ['LSF_SIM_RUN_TIME'] = str(args.run_time)
+    os.environ['LSF_SIM_PEND_TIME'] = str(args.pend_time)
+    os.environ['LSF_SIM_LATENCY'] = str(args.latency)
+    os.environ['LSF_SIM_FAILURE_RATE'] = str(args.failure_rate)
+
+    if args.overhead:
+        overhead(args)
+        return
+
+    columns = ['jobs', 'finished', 'seconds', 'subprocesses', 'heartbeats', 'mean_ms', 'p95_ms', 'max_ms', 'peak_mb']
+    print(''.join(f'{c:>14}' for c in columns))
+    for jobs in args.jobs:
+        result = run(jobs, args)
+        print(''.join(f'{result[c]:>14.1f}' if isinstance(result[c], float) else f'{result[c]:>14}' for c in columns))
+
+
+if __name__ == '__main__':
+    main()
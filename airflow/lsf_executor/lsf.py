@@ -16,135 +16,2045 @@
 
 from airflow.plugins_manager import AirflowPlugin
 from airflow.executors.base_executor import BaseExecutor
+from airflow.configuration import conf, AIRFLOW_HOME
+from airflow.models.taskinstance import TaskInstance, TaskInstanceKey
+from airflow.models.serialized_dag import SerializedDagModel
+from airflow.stats import Stats
+from airflow.utils.state import State
+
+from concurrent.futures import ThreadPoolExecutor, wait
 
 import subprocess
+import collections
+import abc
+import functools
+import threading
+import signal
+import uuid
+import math
+import heapq
+import sqlite3
+import tempfile
+import time
+import shlex
+import json
+import os
 import re
 
+try:
+    from pythonlsf import lsf as lsfapi
+except ImportError:
+    lsfapi = None
+
+# maximum number of job ids passed to one LSF command line
+JOBID_CHUNK_SIZE = 1000
+# reply of `bsub -pack` by a cluster without LSB_MAX_PACK_JOBS, or by a bsub without -pack
+PACK_REJECTED = re.compile(r'LSB_MAX_PACK_JOBS|pack\w* (?:is |are )?(?:disabled|not enabled|not supported)|(?:illegal|invalid|unknown) option.*pack', re.I)
+
 class LSFExecutor(BaseExecutor):
-    def __init__(self):
+    # files of a cluster shard which are not shared with the other shards
+    SHARD_PATHS = ('registry', 'event_offset_file', 'pilot_spool')
+
+    def __init__(self, cluster=None):
+        # a cluster profile of ShardedLSFExecutor, the cluster of the environment by default
+        self.cluster = cluster or {}
+        self.cluster_name = self.cluster.get('name')
+        self.env = cluster_env(self.cluster) if cluster else None
+
         self.jobs = {}
-        self.queues = {}
+        self.job_times = {}
+        # (dag_id, run_id, task_id) -> job id of tracked jobs
+        self.task_jobs = {}
+
+        # queues are refreshed in background. tasks without an LSF queue can be
+        # routed to the least loaded queue.
+        self.catalog = QueueCatalog(self.option('queue_refresh_interval', 60), self.log)
+        self.queue_routing = self.option('queue_routing', '')
+        self.routing_queues = [q.strip() for q in self.option('routing_queues', '').split(',') if q.strip()]
+        self.default_queue = conf.get('operators', 'default_queue', fallback='default')
+
+        # tasks queued in one heartbeat are submitted together by `bsub -pack`
+        self.bulk_submit = self.option('bulk_submit', False)
+        self.pack_size = self.option('pack_size', 500)
+        self.submit_buffer = []
+
+        # output of each job is written to a file of its task under log_root, a
+        # directory shared by the execution hosts and the Airflow webserver
+        self.log_root = self.option('log_root', '')
+        self.task_logs = TaskLogCache(64)
+
+        # tasks are held by the executor while it has too many pending jobs in LSF,
+        # in total or in one queue
+        self.max_pending = self.option('max_pending_jobs', 0)
+        self.max_queue_pending = self.option('max_pending_jobs_per_queue', 0)
+        self.held = []
+        # queue -> number of pending jobs and tasks being submitted, None for the default queue
+        self.pending = {}
+        # queue of the buffered tasks and of the jobs which are not started yet
+        self.reserved = {}
+        self.job_queues = {}
+
+        # LSF commands run in a bounded worker pool so that a slow mbatchd never
+        # blocks the scheduler loop. sync() collects the finished commands.
+        self.command_timeout = self.option('command_timeout', 30)
+        self.kill_timeout = self.option('kill_timeout', 30)
+        # LSF is reached by its commands (cli), its Python API (pythonlsf), or faked in memory (fake).
+        # it is set up by start(), the webserver creates the executor for task logs only.
+        self.transport_name = self.option('transport', 'cli')
+        self.transport = None
+        self.engine = CommandEngine(self.option('command_workers', 4))
+        self.pending_submits = {}
+        self.status_queries = {}
+
+        # optionally follow job status from the LSF event log instead of polling.
+        # bjobs is still used at a low rate in case some events are missed.
+        self.tracker = None
+        event_log = self.cluster.get('event_log', '') if cluster else self.option('event_log', '')
+        if event_log:
+            self.tracker = EventTracker(event_log,
+                self.option('event_offset_file', os.path.join(AIRFLOW_HOME, 'lsf_event_offset.json')),
+                self.log, replay=self.option('event_replay', False))
+
+        # each job is checked by bjobs when it is due, at a rate depending on its status.
+        # with the event log, bjobs only catches up missed events.
+        floor = self.option('event_reconcile_interval', 300) if self.tracker else 0
+        self.poller = PollScheduler(floor=floor, intervals=poll_intervals(self.option('poll_intervals', '')),
+            start=self.option('poll_start_interval', 1.0))
+
+        # short tasks can be run by long-lived pilot jobs instead of one job per task
+        self.pilot = None
+        if self.option('pilot', False):
+            self.pilot = PilotPool(self.option('pilot_spool', os.path.join(AIRFLOW_HOME, 'lsf_pilot')), self.log)
+        self.pilot_min = self.option('pilot_min_workers', 0)
+        self.pilot_max = self.option('pilot_max_workers', 16)
+        self.pilot_backlog = self.option('pilot_tasks_per_worker', 4)
+        self.pilot_options = shlex.split(self.option('pilot_bsub_options', ''))
+        self.pilot_command = [self.option('pilot_python', 'python3'),
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lsf_pilot.py'),
+            '--idle-timeout', self.option('pilot_idle_timeout', '60')]
+        self.pilot_check_interval = self.option('pilot_check_interval', 30)
+        # task id in spool -> task key
+        self.pilot_tasks = {}
+        # pilot job id -> last status
+        self.pilot_jobs = {}
+        self.pilot_submits = {}
+        self.pilot_query = None
+        self.pilot_checked = 0
+
+        # downstream tasks can be submitted right after their upstream jobs with
+        # LSF dependencies, before the scheduler queues them. the job waits in
+        # lsf_eager.py until the scheduler queues the task with it.
+        self.eager_submit = self.option('eager_submit', False)
+        self.eager_command = [self.option('eager_python', 'python3'),
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lsf_eager.py'),
+            '--timeout', self.option('eager_wait_timeout', '600')]
+        # (dag_id, run_id, task_id) -> {'key', 'jobid', 'claimed'} of eagerly submitted tasks
+        # which are not queued by the scheduler yet
+        self.eager = {}
+        self.eager_jobs = {}
+        self.dags = {}
+
+        # resource usage of finished jobs is fetched in bulk and kept per task. memory and
+        # run limits of a task can be set by its history when they are not requested.
+        self.accounting = self.option('accounting', False)
+        self.history = TaskHistory(self.option('accounting_history', 10))
+        self.right_size = self.option('right_size', False)
+        self.right_size_margin = self.option('right_size_margin', 1.5)
+        # jobid -> key of finished jobs, of those being queried
+        self.finished = {}
+        self.harvesting = {}
+        self.accounting_query = None
+
+        # tracked jobs are saved so that a restarted scheduler adopts them
+        self.registry_path = self.option('registry', '')
+        self.registry = None
 
         super().__init__()
 
+    def option(self, name, fallback):
+        # options of a cluster profile override the [lsf] section
+        if name in self.cluster:
+            value = str(self.cluster[name])
+        else:
+            value = conf.get('lsf', name, fallback=fallback)
+            if self.cluster_name and name in self.SHARD_PATHS and value:
+                root, ext = os.path.splitext(value)
+                value = f'{root}.{self.cluster_name}{ext}'
+
+        if isinstance(fallback, bool) and isinstance(value, str):
+            return value.strip().lower() in ('t', 'true', '1', 'yes', 'y')
+        if isinstance(fallback, int) and not isinstance(fallback, bool):
+            return int(value)
+        if isinstance(fallback, float):
+            return float(value)
+        return value
+
     def start(self): 
-        self.log.info("[ LSF ] starting LSF executor")
+        if self.cluster_name:
+            self.log.info(f"[ LSF ] starting LSF executor of cluster {self.cluster_name}")
+        else:
+            self.log.info("[ LSF ] starting LSF executor")
+
+        if self.transport is None:
+            self.transport = make_transport(self.transport_name, self.log, self.command_timeout, env=self.env)
+        if self.log_root and (lsf_conf('LSB_STDOUT_DIRECT', self.env) or 'N').upper() != 'Y':
+            self.log.warning("[ LSF ] LSB_STDOUT_DIRECT=Y is not set in lsf.conf, output files of running jobs are not written to log_root")
 
-        q = run_cmd(['bqueues', '-o', 'QUEUE_NAME', '-noheader'], self.log)
-        if q == None:
+        if self.registry_path:
+            self.registry = JobRegistry(self.registry_path, self.log)
+            for jobid, key in self.registry.load().items():
+                self.track(jobid, key, submitted=False)
+            self.log.info(f"[ LSF ] {len(self.jobs)} jobs are loaded from registry")
+
+        if self.pilot is not None:
+            self.pilot.start()
+
+        self.catalog.start(self.transport)
+        if not self.catalog.queues:
             self.log.warning("LSF: there is no queue found")
             return
 
-        self.queues = {q: True for q in q.strip('\n').split('\n')}
-
-        self.log.info(f"[ LSF ] there are {len(self.queues)} queues: {','.join(self.queues)}")
+        self.log.info(f"[ LSF ] there are {len(self.catalog.queues)} queues: {','.join(self.catalog.queues)}")
 
     def execute_async(self, key, command, queue=None, executor_config=None):
-        self.log.info("[ LSF ] executing async(). key = %s command = %s queue = %s config = %s" % (key, command, queue, executor_config))
+        self.log.debug("[ LSF ] executing async(). key = %s command = %s queue = %s config = %s", key, command, queue, executor_config)
 
         self.validate_command(command)
 
-        options=['-J', f'{key.dag_id}-{key.task_id}-{key.run_id}']
+        ident = task_ident(key)
+        if ident in self.eager:
+            self.claim_eager(ident, (key, command, queue, executor_config))
+            return
+
+        # tasks which request resources are run by their own jobs
+        lsf_config = (executor_config or {}).get('lsf', {})
+        if self.pilot is not None and lsf_config.get('pilot', not RESOURCE_KEYS.intersection(lsf_config)):
+            task_id = uuid.uuid4().hex
+            self.pilot.dispatch(task_id, command)
+            self.pilot_tasks[task_id] = key
+            return
+
+        options = self.task_options(key, queue, executor_config)
+        if self.held or not self.admits(option_value(options, '-q')):
+            self.held.append((key, options, command))
+            return
+
+        self.queue_task(key, options, command)
+        if not self.bulk_submit:
+            self.flush_submissions()
+
+    def admits(self, queue):
+        if self.max_pending and sum(self.pending.values()) >= self.max_pending:
+            return False
+        if self.max_queue_pending and self.pending.get(queue, 0) >= self.max_queue_pending:
+            return False
+
+        return True
+
+    def headroom(self):
+        # number of tasks the executor can take before they are held, None if unlimited
+        if not self.max_pending:
+            return None
+
+        return max(0, self.max_pending - sum(self.pending.values()) - len(self.held))
+
+    @property
+    def slots_available(self):
+        slots = super().slots_available
+        headroom = self.headroom()
+        return slots if headroom is None else min(slots, headroom)
+
+    def queue_task(self, key, options, command):
+        queue = option_value(options, '-q')
+        self.reserved[key] = queue
+        self.count_pending(queue, 1)
+        self.submit_buffer.append((key, options, command))
+
+    def release_held(self):
+        # held tasks are released in order as jobs start, tasks of a full queue
+        # do not block the other queues
+        held, self.held = self.held, []
+        for key, options, command in held:
+            if self.admits(option_value(options, '-q')):
+                self.queue_task(key, options, command)
+            else:
+                self.held.append((key, options, command))
+
+    def count_pending(self, queue, delta):
+        self.pending[queue] = self.pending.get(queue, 0) + delta
+
+    def task_options(self, key, queue, executor_config):
+        options=['-J', task_job_name(key)]
 
         # the queue name is setting when it is an LSF queue name
-        if self.queues.get(queue) != None:
+        if queue in self.catalog.queues:
             options.extend(['-q', queue])
+        elif self.queue_routing == 'least_loaded' and queue in (None, self.default_queue):
+            routed = self.catalog.least_loaded(self.routing_queues)
+            if routed is not None:
+                options.extend(['-q', routed])
+
+        if self.log_root:
+            path = task_log_path(self.log_root, key.dag_id, key.run_id, key.task_id, key.map_index, key.try_number)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            options.extend(['-o', path])
+
+        lsf_config = (executor_config or {}).get('lsf', {})
+        if self.right_size:
+            lsf_config = self.right_sized(key, lsf_config)
+        if RESOURCE_KEYS.intersection(lsf_config):
+            options.extend(resource_options(json.dumps(lsf_config, sort_keys=True, default=str)))
+
+        return options
+
+    def right_sized(self, key, lsf_config):
+        # memory and run limits which are not requested are set by the peak usage of the task
+        peak = self.history.peak(key.dag_id, key.task_id)
+        if peak is None:
+            return lsf_config
+
+        max_mem, run_time = peak
+        defaults = {}
+        if 'memory' not in lsf_config and max_mem:
+            # max_mem is in MB, a number would be read in LSF_UNIT_FOR_LIMITS
+            defaults['memory'] = f'{math.ceil(max_mem * self.right_size_margin)}MB'
+        if 'runtime' not in lsf_config and run_time:
+            defaults['runtime'] = math.ceil(run_time * self.right_size_margin / 60)
+
+        return {**lsf_config, **defaults}
+
+    def get_task_log(self, ti, try_number=None):
+        # returns (messages, logs) for the task log view of Airflow, which asks it for running
+        # tasks. a job writes its output file as it runs only with LSB_STDOUT_DIRECT=Y.
+        if not self.log_root:
+            return [], []
+
+        try_number = try_number or ti.try_number
+        path = task_log_path(self.log_root, ti.dag_id, ti.run_id, ti.task_id, ti.map_index, try_number)
+        try:
+            return [f'Found LSF job output in {path}'], [self.task_logs.read(path)]
+        except FileNotFoundError:
+            pass
+
+        # otherwise the output is kept in the execution host until the job is finished.
+        # the executor of the webserver is not started.
+        jobid = (ti.external_executor_id or '').split(':')[-1]
+        if jobid and try_number == ti.try_number and ti.state == State.RUNNING:
+            transport = self.transport or CLITransport(self.log, self.command_timeout, env=self.env)
+            output = transport.peek(jobid)
+            if output:
+                return [f'Found output of running LSF job <{jobid}> by bpeek'], [output]
+
+        return [f'LSF job output {path} is not found'], []
+
+    def submitted(self, key, jobid):
+        queue = self.reserved.pop(key, None)
+        self.count_pending(queue, -1)
+
+        entry = self.eager.get(task_ident(key))
+        if entry is not None and entry['key'] == key:
+            self.eager_submitted(key, entry, jobid, queue)
+            return
 
-        jobid = bsub(options, command, self.log)
         if (int(jobid) > 0):
-            self.jobs[jobid] = key
+            self.track(jobid, key, queue=queue)
+            # the job id is kept by Airflow as external executor id for adoption
+            self.event_buffer[key] = (State.QUEUED, self.external_id(jobid))
+            if self.eager_submit:
+                self.submit_downstream(key)
+        else:
+            self.log.error(f"[ LSF ] failed to submit task {key}")
+            self.fail(key)
+
+    def submit_downstream(self, key):
+        dag = self.get_dag(key.dag_id)
+        if dag is None or not dag.has_task(key.task_id):
+            return
+
+        for task in dag.get_task(key.task_id).downstream_list:
+            ident = (key.dag_id, key.run_id, task.task_id)
+            if ident in self.task_jobs or ident in self.eager or not eager_candidate(task):
+                continue
+
+            # all upstream tasks must be LSF jobs tracked by the executor
+            upstream = [self.task_jobs.get((key.dag_id, key.run_id, up)) for up in sorted(task.upstream_task_ids)]
+            if None in upstream:
+                continue
+
+            ti = TaskInstance(task, run_id=key.run_id)
+            ti.refresh_from_db()
+            if ti.state is not None:
+                continue
+
+            command = self.eager_command + [ti.dag_id, ti.task_id, ti.run_id, '--map-index', str(ti.map_index), '--']
+            command += ti.command_as_list(local=True, pool=ti.pool)
+            options = self.task_options(ti.key, task.queue, task.executor_config)
+            # -ti: LSF terminates the job at once when an upstream job exits
+            options.extend(['-w', ' && '.join(f'done({jid})' for jid in upstream), '-ti'])
+
+            self.log.debug("[ LSF ] submitting %s after jobs %s", ti.key, upstream)
+            self.eager[ident] = {'key': ti.key, 'jobid': None, 'claimed': None}
+            self.queue_task(ti.key, options, command)
+
+    def get_dag(self, dag_id):
+        dag, loaded = self.dags.get(dag_id, (None, 0))
+        if time.monotonic() - loaded > 60:
+            dag = SerializedDagModel.get_dag(dag_id)
+            self.dags[dag_id] = (dag, time.monotonic())
+
+        return dag
+
+    def eager_submitted(self, key, entry, jobid, queue):
+        ident = task_ident(key)
+        claimed = entry['claimed']
+        if int(jobid) <= 0:
+            self.log.warning(f"[ LSF ] failed to submit task {key} in advance")
+            del self.eager[ident]
+            if claimed is not None:
+                # the scheduler queued it in the meantime, submit it as usual
+                key, command, queue, executor_config = claimed
+                self.queue_task(key, self.task_options(key, queue, executor_config), command)
+            return
+
+        if claimed is not None:
+            del self.eager[ident]
+            self.track(jobid, claimed[0], queue=queue)
+            self.event_buffer[claimed[0]] = (State.QUEUED, self.external_id(jobid))
+        else:
+            # the job is saved in the registry once it is claimed, a restarted
+            # scheduler queues the task with a job of its own
+            entry['jobid'] = jobid
+            self.eager_jobs[jobid] = ident
+            self.track(jobid, key, queue=queue)
+
+        self.submit_downstream(key)
+
+    def claim_eager(self, ident, claimed):
+        # the scheduler queues a task which is already submitted, use the job
+        entry = self.eager[ident]
+        jobid = entry['jobid']
+        if jobid is None:
+            entry['claimed'] = claimed
+            return
+
+        # the job runs the task once the scheduler records it as the external executor id
+        key = claimed[0]
+        del self.eager[ident]
+        del self.eager_jobs[jobid]
+        self.rekey(jobid, key)
+        self.event_buffer[key] = (State.QUEUED, self.external_id(jobid))
+
+    def external_id(self, jobid):
+        # job ids of a cluster shard are prefixed by the cluster name
+        return f'{self.cluster_name}:{jobid}' if self.cluster_name else jobid
+
+    def backlog(self):
+        # pending jobs of the cluster as of the last queue refresh, and the tasks
+        # which are not seen by LSF yet
+        pending = sum(to_int(record.get('PEND')) for record in self.catalog.queues.values())
+        submitting = sum(len(keys) for keys in self.pending_submits.values())
+        unseen = len(self.jobs) - sum(self.poller.counts.values())
+        return pending + len(self.submit_buffer) + submitting + unseen + len(self.held)
+
+    def track(self, jobid, key, submitted=True, queue=None):
+        self.jobs[jobid] = key
+        # a job is pending until it is seen otherwise
+        self.job_queues[jobid] = queue
+        self.count_pending(queue, 1)
+        self.task_jobs[task_ident(key)] = jobid
+        self.poller.add(jobid, time.monotonic())
+        # (submit time, start time) for metrics, unknown for adopted jobs
+        self.job_times[jobid] = [time.monotonic() if submitted else None, None]
+        if self.registry is not None and jobid not in self.eager_jobs:
+            self.registry.add(jobid, key)
+
+    def untrack(self, jobid):
+        key = self.jobs.pop(jobid)
+        self.started(jobid)
+        if self.task_jobs.get(task_ident(key)) == jobid:
+            del self.task_jobs[task_ident(key)]
+        self.poller.remove(jobid)
+        self.job_times.pop(jobid, None)
+        if self.registry is not None:
+            self.registry.remove(jobid)
+
+    def try_adopt_task_instances(self, tis):
+        tracked = {key: jid for jid, key in self.jobs.items()}
+
+        not_adopted = []
+        by_name = {}
+        for ti in tis:
+            jid = ti.external_executor_id
+            if self.cluster_name and jid:
+                jid = jid.split(':')[-1]
+            if jid not in self.jobs:
+                jid = tracked.get(ti.key)
+
+            if jid is not None:
+                self.adopt(jid, ti.key)
+            else:
+                by_name[task_job_name(ti.key)] = ti
+
+        if not by_name:
+            return not_adopted
+
+        # find the rest by job names in one query of all jobs, recently finished ones included
+        found = {}
+        records = self.transport.status(None, fields=('jobid', 'job_name', 'stat'))
+        for jid, record in records.items():
+            name = record.get('JOB_NAME')
+            # a retried task has several jobs with the same name, the latest one is used
+            if name in by_name and int(jid) > int(found.get(name, 0)):
+                found[name] = jid
+
+        for name, ti in by_name.items():
+            if name in found:
+                self.adopt(found[name], ti.key)
+            else:
+                not_adopted.append(ti)
+
+        self.log.info(f"[ LSF ] adopted {len(tis) - len(not_adopted)} of {len(tis)} task instances")
+        return not_adopted
+
+    def adopt(self, jobid, key):
+        # jobs loaded from the registry are tracked already, with the key they were saved with
+        if jobid in self.jobs:
+            self.rekey(jobid, key)
+        else:
+            self.track(jobid, key, submitted=False)
+        self.running.add(key)
+
+    def rekey(self, jobid, key):
+        old = self.jobs[jobid]
+        self.jobs[jobid] = key
+        if self.task_jobs.get(task_ident(old)) == jobid:
+            del self.task_jobs[task_ident(old)]
+        self.task_jobs[task_ident(key)] = jobid
+        if self.registry is not None:
+            self.registry.add(jobid, key)
+
+    def flush_submissions(self):
+        buffered, self.submit_buffer = self.submit_buffer, []
+        for chunk in chunks(buffered, self.pack_size):
+            requests = [(options, command) for _, options, command in chunk]
+            future = self.engine.submit(self.transport.submit, requests)
+            self.pending_submits[future] = [key for key, _, _ in chunk]
+
+    def collect_submissions(self, timeout=0):
+        done, _ = wait(list(self.pending_submits), timeout=timeout)
+        for future in done:
+            keys = self.pending_submits.pop(future)
+            try:
+                jobids = future.result()
+            except Exception:
+                self.log.exception(f"[ LSF ] failed to submit {len(keys)} tasks")
+                jobids = ['0'] * len(keys)
+
+            for key, jobid in zip(keys, jobids):
+                self.submitted(key, jobid)
+
+    def collect_status(self):
+        if not all(future.done() for future in self.status_queries):
+            return
+
+        now = time.monotonic()
+        queries, self.status_queries = self.status_queries, {}
+        for future, chunk in queries.items():
+            try:
+                records = future.result()
+            except Exception:
+                self.log.exception("[ LSF ] failed to query job status")
+                records = {}
+
+            self.process_status(records)
+
+            # jobs without answer are checked again later
+            for jid in chunk:
+                if jid in self.jobs and jid not in records:
+                    self.poller.observe(jid, self.poller.stat(jid), now)
+
+        # query status of the jobs which are due in bulk instead of one bjobs per job,
+        # one command per chunk of job ids
+        for chunk in chunks(self.poller.due(now), JOBID_CHUNK_SIZE):
+            self.status_queries[self.engine.submit(self.transport.status, chunk)] = chunk
+
+    def process_status(self, records):
+        now = time.monotonic()
+        for jid, record in records.items():
+            key = self.jobs.get(jid)
+            if key is None:
+                continue
+
+            stat = record.get('STAT')
+            if 'ERROR' in record:
+                self.log.warning(f"[ LSF ] job <{jid}> is lost: {record['ERROR']}")
+                stat = 'EXIT'
+
+            self.record_times(jid, stat, now)
+            if stat not in ('PEND', 'PSUSP'):
+                self.started(jid)
+            if stat not in ('DONE', 'EXIT'):
+                self.poller.observe(jid, stat, now)
+                continue
+
+            unclaimed = jid in self.eager_jobs
+            if unclaimed:
+                # the job is finished before the scheduler queued the task, so it did not run
+                # the task: an upstream job exited, or lsf_eager.py gave up waiting.
+                # the scheduler queues the task later and it is submitted as usual.
+                self.log.info(f"[ LSF ] job <{jid}> of {key} is finished without running the task")
+                self.eager.pop(self.eager_jobs.pop(jid), None)
+            elif stat == 'DONE':
+                self.success(key)
+            else:
+                self.log.info(f"[ LSF ] job <{jid}> exited with code {record.get('EXIT_CODE')}")
+                self.fail(key)
+
+            # a job which did not run its task has no usage of the task
+            if self.accounting and 'ERROR' not in record and not unclaimed:
+                self.finished[jid] = key
+            self.untrack(jid)
+
+    def harvest(self):
+        # one query for the usage of all jobs finished since the last query
+        if self.accounting_query is not None:
+            if not self.accounting_query.done():
+                return
+
+            try:
+                records = self.accounting_query.result()
+            except Exception:
+                self.log.exception("[ LSF ] failed to query accounting of finished jobs")
+                records = {}
+            self.accounting_query = None
+
+            for jid, record in records.items():
+                key = self.harvesting.get(jid)
+                if key is not None and 'ERROR' not in record:
+                    self.record_usage(jid, key, record)
+            self.harvesting = {}
+
+        if self.finished:
+            self.harvesting, self.finished = self.finished, {}
+            self.accounting_query = self.engine.submit(self.transport.status, list(self.harvesting),
+                fields=('jobid', 'max_mem', 'run_time', 'cpu_used', 'exit_reason'))
+
+    def record_usage(self, jobid, key, record):
+        max_mem = memory_mb(record.get('MAX_MEM'))
+        run_time = seconds(record.get('RUN_TIME'))
+        cpu_used = seconds(record.get('CPU_USED'))
+        self.history.add(key.dag_id, key.task_id, (max_mem, run_time, cpu_used))
+
+        name = f'lsf_executor.task.{key.dag_id}.{key.task_id}'
+        if max_mem is not None:
+            Stats.gauge(f'{name}.max_mem', max_mem)
+        if run_time is not None:
+            Stats.timing(f'{name}.run_time', run_time * 1000)
+        if cpu_used is not None:
+            Stats.timing(f'{name}.cpu_used', cpu_used * 1000)
+        if record.get('EXIT_REASON'):
+            self.log.info(f"[ LSF ] job <{jobid}> of task {key}: {record['EXIT_REASON']}")
+
+    def started(self, jobid):
+        if jobid in self.job_queues:
+            self.count_pending(self.job_queues.pop(jobid), -1)
+
+    def record_times(self, jobid, stat, now):
+        times = self.job_times.get(jobid)
+        if times is None:
+            return
+
+        submitted, started = times
+        if started is None and stat in ('RUN', 'DONE', 'EXIT'):
+            times[1] = started = now
+            if submitted is not None:
+                Stats.timing('lsf_executor.job.submit_to_run', (now - submitted) * 1000)
+
+        if stat in ('DONE', 'EXIT') and started is not None:
+            Stats.timing('lsf_executor.job.run_to_end', (now - started) * 1000)
 
     def sync(self):
-        self.log.info("LSF: executing sync()")
+        self.log.debug("[ LSF ] executing sync()")
+
+        start = time.monotonic()
+        self.sync_jobs()
+
+        Stats.timing('lsf_executor.sync', (time.monotonic() - start) * 1000)
+        Stats.gauge('lsf_executor.tracked_jobs', len(self.jobs))
+        Stats.gauge('lsf_executor.pending_jobs', self.poller.count('PEND'))
+        Stats.gauge('lsf_executor.running_jobs', self.poller.count('RUN'))
+        Stats.gauge('lsf_executor.submitting_tasks', sum(len(keys) for keys in self.pending_submits.values()))
+        Stats.gauge('lsf_executor.held_tasks', len(self.held))
+
+    def sync_jobs(self):
+        # never wait for LSF here, whatever is not finished is collected next time
+        self.collect_submissions()
+
+        if self.held:
+            self.release_held()
+
+        # tasks of this heartbeat, and downstream tasks of the jobs just submitted
+        if self.submit_buffer:
+            self.flush_submissions()
+
+        if self.tracker is not None:
+            self.process_status(self.tracker.read(self.jobs))
+
+        self.collect_status()
+
+        if self.pilot is not None:
+            self.sync_pilots()
+
+        if self.accounting:
+            self.harvest()
 
-        # TODO: bjobs job_ids instead of multiple bjobs. It may be all in one or sub set of jobs by one request
-        for jid in list(self.jobs.keys()):
-            stat = bjobs(jid, self.log)
-            if stat is None:
-                del self.jobs[jid]
+        # changes of tracked jobs are written once per heartbeat
+        if self.registry is not None:
+            self.registry.flush()
+
+    def sync_pilots(self):
+        for task_id, rc in self.pilot.results():
+            key = self.pilot_tasks.pop(task_id, None)
+            if key is None:
+                continue
+            if rc == 0:
+                self.success(key)
+            else:
+                self.fail(key)
+
+        done, _ = wait(list(self.pilot_submits), timeout=0)
+        for future in done:
+            count = self.pilot_submits.pop(future)
+            try:
+                jobids = future.result()
+            except Exception:
+                self.log.exception(f"[ LSF ] failed to submit {count} pilot jobs")
                 continue
+            for jobid in jobids:
+                if int(jobid) > 0:
+                    self.pilot_jobs[jobid] = 'PEND'
+
+        # pilot jobs are checked at a low rate, tasks of dead pilots are failed
+        if self.pilot_query is not None and self.pilot_query.done():
+            try:
+                records = self.pilot_query.result()
+            except Exception:
+                self.log.exception("[ LSF ] failed to query pilot jobs")
+                records = {}
+            self.pilot_query = None
+
+            for jid, record in records.items():
+                stat = 'EXIT' if 'ERROR' in record else record.get('STAT')
+                if stat not in ('DONE', 'EXIT'):
+                    self.pilot_jobs[jid] = stat
+                    continue
+
+                self.pilot_jobs.pop(jid, None)
+                for task_id in self.pilot.lost(jid):
+                    key = self.pilot_tasks.pop(task_id, None)
+                    if key is not None:
+                        self.log.warning(f"[ LSF ] task {key} is lost with pilot job <{jid}>")
+                        self.fail(key)
 
-            if stat == 'DONE':
-                self.success(self.jobs[jid])
-                del self.jobs[jid]
-            if stat == 'EXIT':
-                self.fail(self.jobs[jid])
-                del self.jobs[jid]
+        now = time.monotonic()
+        if self.pilot_query is None and self.pilot_jobs and now - self.pilot_checked >= self.pilot_check_interval:
+            self.pilot_checked = now
+            self.pilot_query = self.engine.submit(self.transport.status, list(self.pilot_jobs))
+
+        # one pilot per running task, plus enough pilots for the backlog. idle pilots exit by themselves.
+        backlog = self.pilot.backlog()
+        busy = len(self.pilot_tasks) - backlog
+        wanted = max(self.pilot_min, min(self.pilot_max, busy + math.ceil(backlog / self.pilot_backlog)))
+        alive = len(self.pilot_jobs) + sum(self.pilot_submits.values())
+        if wanted > alive:
+            requests = [(['-J', 'airflow-pilot'] + self.pilot_options, self.pilot_command + [self.pilot.spool])] * (wanted - alive)
+            self.log.info(f"[ LSF ] submitting {len(requests)} pilot jobs for {backlog} queued tasks")
+            future = self.engine.submit(self.transport.submit, requests)
+            self.pilot_submits[future] = len(requests)
+
+        Stats.gauge('lsf_executor.pilot.workers', len(self.pilot_jobs))
+        Stats.gauge('lsf_executor.pilot.backlog', backlog)
 
     def end(self):
         self.log.info("LSF: executing end()")
 
-        for jid in list(self.jobs.keys()):
-            bkill(jid, self.log)
-            del self.jobs[jid]
+        # tasks which are being submitted are killed together with the others
+        self.submit_buffer = []
+        self.held = []
+        self.collect_submissions(timeout=self.command_timeout)
+
+        # pilots exit after their current task
+        if self.pilot is not None:
+            self.pilot.stop()
 
-        self.heartbeat()
+        # jobs are kept running and adopted by the next scheduler when they are saved,
+        # except the eager jobs which are not claimed
+        if self.registry is not None:
+            if self.eager_jobs:
+                self.kill_jobs(list(self.eager_jobs))
+            self.registry.flush()
+            self.registry.close()
+            self.catalog.stop()
+            self.engine.shutdown()
+            return
+
+        self.kill_jobs()
+        self.catalog.stop()
+        self.engine.shutdown()
 
     def terminate(self):
         self.log.info("LSF: executing terminate()")
 
-        for jid in self.jobs.keys():
-            bkill(jid, self.log)
-            del self.jobs[jid]
+        self.submit_buffer = []
+        self.held = []
+        if self.pilot is not None:
+            self.pilot.stop()
+        self.kill_jobs()
+        if self.registry is not None:
+            self.registry.flush()
+            self.registry.close()
+
+        self.catalog.stop()
+        self.engine.shutdown()
+
+    def kill_jobs(self, jobids=None):
+        # kills all tracked jobs by bkill of large batches of job ids in parallel,
+        # and gives up on whatever is not done in kill_timeout seconds
+        if jobids is None:
+            jobids = list(self.jobs.keys()) + list(self.pilot_jobs.keys())
+        if not jobids:
+            return {}
+
+        # status queries which are not started yet are not needed anymore
+        for future in self.status_queries:
+            future.cancel()
+
+        self.log.info(f"[ LSF ] killing {len(jobids)} jobs")
+        futures = [self.engine.submit(self.transport.kill, chunk, timeout=self.kill_timeout)
+            for chunk in chunks(jobids, JOBID_CHUNK_SIZE)]
+        done, _ = wait(futures, timeout=self.kill_timeout)
+
+        outcomes = {}
+        for future in done:
+            try:
+                outcomes.update(future.result())
+            except Exception:
+                self.log.exception("[ LSF ] failed to kill jobs")
+
+        summary = {}
+        for jid in jobids:
+            outcome = outcomes.setdefault(jid, 'not killed in time')
+            result = kill_result(outcome)
+            summary[result] = summary.get(result, 0) + 1
+            if result == 'failed':
+                self.log.warning(f"[ LSF ] failed to kill job <{jid}>: {outcome}")
+            if jid in self.jobs:
+                self.untrack(jid)
+            self.pilot_jobs.pop(jid, None)
+
+        self.log.info(f"[ LSF ] kill result: {summary}")
+        return outcomes
+
+
+class ShardedLSFExecutor(BaseExecutor):
+    """
+    spreads tasks over several LSF clusters, one LSFExecutor per cluster profile
+    """
+
+    def __init__(self):
+        # [{"name": "cluster1", "envdir": "/opt/lsf1/conf", "serverdir": "...", ...}, ...]
+        profiles = json.loads(conf.get('lsf', 'clusters', fallback='[]'))
+        if not profiles:
+            raise ValueError('[lsf] clusters is not configured')
+
+        self.shards = {}
+        for profile in profiles:
+            if ':' in profile['name'] or profile['name'] in self.shards:
+                raise ValueError(f"invalid cluster name {profile['name']}")
+            self.shards[profile['name']] = LSFExecutor(cluster=profile)
+
+        super().__init__()
+
+    def start(self):
+        self.log.info(f"[ LSF ] starting LSF executor of {len(self.shards)} clusters")
+        for shard in self.shards.values():
+            shard.start()
+
+    def execute_async(self, key, command, queue=None, executor_config=None):
+        shard = self.route(key, queue, executor_config)
+        shard.running.add(key)
+        shard.execute_async(key, command, queue, executor_config)
+
+    @property
+    def slots_available(self):
+        slots = super().slots_available
+        headrooms = [shard.headroom() for shard in self.shards.values()]
+        if None in headrooms:
+            return slots
+
+        return min(slots, sum(headrooms))
+
+    def route(self, key, queue, executor_config):
+        # a task submitted in advance is in the cluster of its upstream jobs
+        ident = task_ident(key)
+        for shard in self.shards.values():
+            if ident in shard.eager:
+                return shard
+
+        lsf_config = (executor_config or {}).get('lsf', {})
+        cluster = lsf_config.get('cluster')
+        if cluster is not None:
+            if cluster in self.shards:
+                return self.shards[cluster]
+            self.log.warning(f"[ LSF ] unknown cluster {cluster} of task {key}")
+
+        # clusters which have the queue, then the cluster with the least backlog
+        candidates = [shard for shard in self.shards.values() if queue in shard.catalog.queues]
+        return min(candidates or self.shards.values(), key=lambda shard: shard.backlog())
+
+    def sync(self):
+        for shard in self.shards.values():
+            shard.sync()
+
+            for key, (state, info) in shard.get_event_buffer().items():
+                if state == State.QUEUED:
+                    self.event_buffer[key] = (state, info)
+                else:
+                    self.change_state(key, state, info)
+
+    def try_adopt_task_instances(self, tis):
+        # job ids are prefixed by cluster names, tasks of unknown clusters are
+        # looked for in every cluster
+        by_cluster = {}
+        rest = []
+        for ti in tis:
+            cluster = (ti.external_executor_id or '').partition(':')[0]
+            if cluster in self.shards:
+                by_cluster.setdefault(cluster, []).append(ti)
+            else:
+                rest.append(ti)
+
+        not_adopted = []
+        for name, shard in self.shards.items():
+            if name in by_cluster:
+                not_adopted.extend(shard.try_adopt_task_instances(by_cluster[name]))
+            if rest:
+                rest = shard.try_adopt_task_instances(rest)
+
+        adopted = {ti.key for ti in tis} - {ti.key for ti in not_adopted + rest}
+        self.running.update(adopted)
+        return not_adopted + rest
+
+    def get_task_log(self, ti, try_number=None):
+        cluster = (ti.external_executor_id or '').partition(':')[0]
+        shard = self.shards.get(cluster) or next(iter(self.shards.values()))
+        return shard.get_task_log(ti, try_number)
+
+    def end(self):
+        for shard in self.shards.values():
+            shard.end()
+
+    def terminate(self):
+        for shard in self.shards.values():
+            shard.terminate()
+
+
+# keys of executor_config['lsf'] which are translated to bsub options
+RESOURCE_KEYS = frozenset(('cores', 'memory', 'runtime', 'span', 'affinity', 'gpu'))
+
+# LSF job status bits in lsb.events/lsb.stream, most significant status first
+JOB_STAT_BITS = [
+    (0x40, 'DONE'),
+    (0x20, 'EXIT'),
+    (0x04, 'RUN'),
+    (0x08, 'SSUSP'),
+    (0x10, 'USUSP'),
+    (0x02, 'PSUSP'),
+    (0x01, 'PEND'),
+    (0x10000, 'UNKWN'),
+]
+
+def job_stat(mask):
+    for bit, stat in JOB_STAT_BITS:
+        if mask & bit:
+            return stat
+
+    return None
+
+
+class PollScheduler:
+    """
+    keeps the time each job is due to be checked in a heap. a new job is checked at
+    doubling ages from `start` seconds, then less often the longer it stays in the
+    same status.
+    """
+
+    # (first, longest) seconds between checks by the last observed status
+    INTERVALS = {
+        None: (0, 0),
+        'PEND': (10, 120),
+        'RUN': (5, 60),
+        'PSUSP': (60, 300),
+        'USUSP': (60, 300),
+        'SSUSP': (30, 300),
+        'UNKWN': (30, 120),
+    }
+
+    def __init__(self, floor=0, intervals=None, start=1):
+        self.floor = floor
+        self.intervals = {**self.INTERVALS, **(intervals or {})}
+        self.start = start
+        self.heap = []
+        # jobid -> (status, since, due, added)
+        self.jobs = {}
+        # number of jobs by status
+        self.counts = {}
+
+    def add(self, jobid, now):
+        due = now + self.floor
+        self.jobs[jobid] = (None, now, due, now)
+        heapq.heappush(self.heap, (due, jobid))
+
+    def remove(self, jobid):
+        # the entry in the heap is dropped when it is popped
+        job = self.jobs.pop(jobid, None)
+        if job is not None and job[0] is not None:
+            self.counts[job[0]] -= 1
+
+    def stat(self, jobid):
+        return self.jobs[jobid][0]
+
+    def count(self, stat):
+        return self.counts.get(stat, 0)
+
+    def observe(self, jobid, stat, now):
+        last, since, _, added = self.jobs.get(jobid, (None, now, now, now))
+        if stat != last:
+            since = now
+            if last is not None:
+                self.counts[last] -= 1
+            if stat is not None:
+                self.counts[stat] = self.counts.get(stat, 0) + 1
+
+        first, longest = self.intervals.get(stat, self.intervals['UNKWN'])
+        interval = min(longest, first + (now - since) / 10)
+        # short jobs are finished before the first interval of their status
+        if now - added < interval:
+            interval = max(self.start, now - added)
+        interval = max(self.floor, interval)
+
+        self.jobs[jobid] = (stat, since, now + interval, added)
+        heapq.heappush(self.heap, (now + interval, jobid))
+
+    def due(self, now):
+        jobids = []
+        while self.heap and self.heap[0][0] <= now:
+            due, jobid = heapq.heappop(self.heap)
+            job = self.jobs.get(jobid)
+            # skip jobs which are not tracked anymore or rescheduled
+            if job is not None and job[2] == due:
+                jobids.append(jobid)
+
+        return jobids
+
+
+class EventTracker:
+    """
+    follows job status changes by tailing the LSF event log (lsb.stream or lsb.events)
+    """
+
+    def __init__(self, path, offset_path, log, replay=False, max_read=16 << 20):
+        self.path = path
+        self.offset_path = offset_path
+        self.log = log
+        self.max_read = max_read
+
+        self.inode = None
+        self.offset = 0
+        if not replay:
+            self.load_offset()
+
+    def load_offset(self):
+        try:
+            with open(self.offset_path) as f:
+                saved = json.load(f)
+            self.inode, self.offset = saved['inode'], saved['offset']
+        except (OSError, ValueError, KeyError):
+            # nothing is saved, only follow events from now on
+            try:
+                st = os.stat(self.path)
+                self.inode, self.offset = st.st_ino, st.st_size
+            except OSError:
+                pass
+
+    def save_offset(self):
+        tmp = self.offset_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'inode': self.inode, 'offset': self.offset}, f)
+        os.replace(tmp, self.offset_path)
+
+    def read(self, jobids):
+        # returns {jobid: record} with the latest status of the given jobs since last read
+        records = {}
+        try:
+            st = os.stat(self.path)
+        except OSError as e:
+            self.log.warning(f'[ LSF ] error: cannot read event log: {e}')
+            return records
+
+        if self.inode is None:
+            self.inode = st.st_ino
+        elif st.st_ino != self.inode or st.st_size < self.offset:
+            # the log is rotated, finish the rotated file before starting the new one
+            rotated = self.rotated_path()
+            if rotated is not None:
+                self.read_file(rotated, jobids, records)
+            self.log.info(f'[ LSF ] event log {self.path} is rotated')
+            self.inode, self.offset = st.st_ino, 0
 
-def bkill(jobid, log):
-    cmd = ["bkill", "-C", "job is killed because airflow is ended", jid]
-    log.info(f'[ LSF ] request: {cmd}')
+        if st.st_size > self.offset:
+            self.read_file(self.path, jobids, records)
+            self.save_offset()
 
-    run_cmd(cmd, log)
+        return records
 
-def bjobs(jobid, log):
-    cmd = ['bjobs', '-o', 'stat', '-noheader', jobid]
-    log.info(f'[ LSF ] request: {cmd}')
+    def rotated_path(self):
+        for suffix in ('.0', '.1'):
+            try:
+                if os.stat(self.path + suffix).st_ino == self.inode:
+                    return self.path + suffix
+            except OSError:
+                continue
+
+        return None
+
+    def read_file(self, path, jobids, records):
+        with open(path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read(self.max_read)
+
+        # a partially written record is read next time
+        end = data.rfind(b'\n')
+        if end < 0:
+            return
+        self.offset += end + 1
+
+        for line in data[:end].split(b'\n'):
+            if not line.startswith((b'"JOB_STATUS"', b'"JOB_FINISH"')):
+                continue
+
+            record = parse_event(line, jobids)
+            if record is not None:
+                records[record['JOBID']] = record
+
+def parse_event(line, jobids):
+    # "JOB_STATUS" "version" eventTime jobId jStatus ...
+    fields = line.split(b' ', 5)
+    if len(fields) < 5:
+        return None
+
+    jobid = fields[3].decode()
+    if jobid not in jobids:
+        return None
+
+    try:
+        if fields[0] == b'"JOB_STATUS"':
+            mask = int(fields[4])
+        else:
+            # JOB_FINISH has host lists and quoted strings before jStatus
+            fields = shlex.split(line.decode(errors='replace'))
+            num_asked = int(fields[22])
+            num_exec = int(fields[23 + num_asked])
+            mask = int(fields[24 + num_asked + num_exec])
+    except (ValueError, IndexError):
+        return None
+
+    stat = job_stat(mask)
+    if stat is None:
+        return None
+
+    return {'JOBID': jobid, 'STAT': stat}
+
+
+class TaskHistory:
+    """
+    (max memory in MB, run time and cpu time in seconds) of the last finished jobs of each task
+    """
+
+    def __init__(self, size):
+        self.size = size
+        # (dag_id, task_id) -> deque of usages
+        self.tasks = {}
+
+    def add(self, dag_id, task_id, usage):
+        history = self.tasks.get((dag_id, task_id))
+        if history is None:
+            history = self.tasks[(dag_id, task_id)] = collections.deque(maxlen=self.size)
+        history.append(usage)
+
+    def peak(self, dag_id, task_id, samples=3):
+        # (max memory, run time) of the task, None if it has not run often enough
+        history = self.tasks.get((dag_id, task_id))
+        if history is None or len(history) < samples:
+            return None
+
+        return (max(u[0] or 0 for u in history), max(u[1] or 0 for u in history))
+
+
+class TaskLogCache:
+    """
+    tails of recently read task log files. a file is read from where it was read
+    last time, so following a running task only reads what is appended. at most
+    max_file bytes are kept of a file, and max_total bytes of all files.
+    """
+
+    def __init__(self, size, max_file=1 << 20, max_total=16 << 20):
+        self.size = size
+        self.max_file = max_file
+        self.max_total = max_total
+        # path -> (inode, read offset, tail of the content)
+        self.files = collections.OrderedDict()
+        self.total = 0
+        self.lock = threading.Lock()
+
+    def read(self, path):
+        with self.lock:
+            stat = os.stat(path)
+            inode, offset, tail = self.files.pop(path, (stat.st_ino, 0, b''))
+            self.total -= len(tail)
+            if inode != stat.st_ino or stat.st_size < offset:
+                # the file is rewritten
+                offset, tail = 0, b''
+
+            if stat.st_size > offset:
+                # only the end of a large file is read
+                start = max(offset, stat.st_size - self.max_file)
+                with open(path, 'rb') as f:
+                    f.seek(start)
+                    appended = f.read(stat.st_size - start)
+
+                tail = tail + appended if start == offset else appended
+                if start > offset or len(tail) > self.max_file:
+                    # the kept tail starts at a line
+                    tail = tail[-self.max_file:]
+                    tail = tail[tail.find(b'\n') + 1:]
+                offset = start + len(appended)
+
+            self.files[path] = (stat.st_ino, offset, tail)
+            self.total += len(tail)
+            while len(self.files) > self.size or self.total > self.max_total:
+                _, (_, _, dropped) = self.files.popitem(last=False)
+                self.total -= len(dropped)
+
+        content = tail.decode('utf-8', errors='replace')
+        if offset > len(tail):
+            content = f'[ LSF ] the first {offset - len(tail)} bytes of {path} are not shown\n' + content
+        return content
+
+
+class JobRegistry:
+    """
+    saves tracked jobs in a sqlite database, changes are written in batches by flush()
+    """
+
+    def __init__(self, path, log):
+        self.log = log
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS jobs (jobid TEXT PRIMARY KEY, task TEXT NOT NULL)')
+        self.db.commit()
+
+        self.added = {}
+        self.removed = set()
+
+    def load(self):
+        jobs = {}
+        for jobid, task in self.db.execute('SELECT jobid, task FROM jobs'):
+            jobs[jobid] = TaskInstanceKey(*json.loads(task))
+
+        return jobs
+
+    def add(self, jobid, key):
+        self.added[jobid] = key
+        self.removed.discard(jobid)
+
+    def remove(self, jobid):
+        if self.added.pop(jobid, None) is None:
+            self.removed.add(jobid)
+
+    def flush(self):
+        if not self.added and not self.removed:
+            return
+
+        try:
+            with self.db:
+                self.db.executemany('INSERT OR REPLACE INTO jobs VALUES (?, ?)',
+                    [(jobid, json.dumps(list(key))) for jobid, key in self.added.items()])
+                self.db.executemany('DELETE FROM jobs WHERE jobid = ?', [(jobid,) for jobid in self.removed])
+        except sqlite3.Error as e:
+            self.log.error(f'[ LSF ] error: failed to save jobs in registry: {e}')
+            return
+
+        self.added.clear()
+        self.removed.clear()
+
+    def close(self):
+        self.db.close()
+
+
+class PilotPool:
+    """
+    spool directory where tasks are dispatched to pilot jobs, see lsf_pilot.py
+    """
+
+    def __init__(self, spool, log):
+        self.spool = spool
+        self.log = log
+
+    def start(self):
+        for d in ('queue', 'running', 'done', 'tmp'):
+            os.makedirs(os.path.join(self.spool, d), exist_ok=True)
+
+        # tasks of a previous scheduler are unknown to this one, which queues them again.
+        # they are dropped before the pilots are allowed to claim tasks.
+        stale = self.purge('queue') + self.purge('done')
+        if stale:
+            self.log.warning(f'[ LSF ] {stale} tasks and results of a previous scheduler are removed from {self.spool}')
+
+        try:
+            os.unlink(os.path.join(self.spool, 'stop'))
+        except FileNotFoundError:
+            pass
+
+    def stop(self):
+        open(os.path.join(self.spool, 'stop'), 'w').close()
+
+    def purge(self, d):
+        count = 0
+        for name in os.listdir(os.path.join(self.spool, d)):
+            try:
+                os.unlink(os.path.join(self.spool, d, name))
+                count += 1
+            except FileNotFoundError:
+                pass
+
+        return count
+
+    def dispatch(self, task_id, command):
+        tmp = os.path.join(self.spool, 'tmp', task_id + '.json')
+        with open(tmp, 'w') as f:
+            json.dump({'command': list(command)}, f)
+        os.rename(tmp, os.path.join(self.spool, 'queue', task_id + '.json'))
+
+    def backlog(self):
+        return len(os.listdir(os.path.join(self.spool, 'queue')))
+
+    def results(self):
+        done = os.path.join(self.spool, 'done')
+        results = []
+        for name in os.listdir(done):
+            if name.startswith('.') or not name.endswith('.json'):
+                continue
+
+            path = os.path.join(done, name)
+            try:
+                with open(path) as f:
+                    rc = json.load(f)['rc']
+                os.unlink(path)
+            except (OSError, ValueError, KeyError) as e:
+                self.log.warning(f'[ LSF ] error: failed to read task result {path}: {e}')
+                continue
+
+            results.append((name[:-len('.json')], rc))
+
+        return results
+
+    def lost(self, jobid):
+        # tasks which are claimed by a pilot job which is finished
+        running = os.path.join(self.spool, 'running', jobid)
+        try:
+            names = os.listdir(running)
+        except FileNotFoundError:
+            return []
+
+        for name in names:
+            os.unlink(os.path.join(running, name))
+        os.rmdir(running)
+        return [name[:-len('.json')] for name in names if name.endswith('.json')]
+
+
+class QueueCatalog:
+    """
+    status and load of LSF queues, refreshed by `bqueues -json` in a background thread
+    """
+
+    FIELDS = ('queue_name', 'status', 'max', 'njobs', 'pend', 'run')
+
+    def __init__(self, ttl, log):
+        self.ttl = ttl
+        self.log = log
+        # queue name -> bqueues record, replaced as a whole on refresh
+        self.queues = {}
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self, transport):
+        self.transport = transport
+        self.refresh()
+
+        self.thread = threading.Thread(target=self.run, name='lsf-queues', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.wait(self.ttl):
+            self.refresh()
+
+    def refresh(self):
+        records = self.transport.queues(self.FIELDS)
+        if records:
+            self.queues = {record['QUEUE_NAME']: record for record in records}
+
+    def least_loaded(self, candidates=None):
+        # open and active queue with least pending jobs, then with least used slots
+        best, best_load = None, None
+        for name in candidates or self.queues:
+            record = self.queues.get(name)
+            if record is None or not record.get('STATUS', '').startswith('Open:Active'):
+                continue
+
+            pend, run = to_int(record.get('PEND')), to_int(record.get('RUN'))
+            limit = to_int(record.get('MAX'))
+            load = (pend, run / limit if limit else 0)
+            if best_load is None or load < best_load:
+                best, best_load = name, load
+
+        if best is not None:
+            # count the routed task until the next refresh, so that tasks of
+            # one heartbeat are spread over queues
+            record = self.queues[best]
+            record['PEND'] = str(to_int(record.get('PEND')) + 1)
+
+        return best
+
+def to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+class CommandEngine:
+    """
+    runs LSF commands in a bounded pool of worker threads and returns futures
+    """
+
+    def __init__(self, max_workers):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='lsf-cmd')
+
+    def submit(self, fn, *args, **kwargs):
+        return self.pool.submit(fn, *args, **kwargs)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
+
+class Transport(abc.ABC):
+    """
+    LSF operations of the executor. job status records are keyed like `bjobs -json`,
+    e.g. {'JOBID': '101', 'STAT': 'RUN'}.
+    """
+
+    def __init__(self, log, timeout, env=None):
+        self.log = log
+        self.timeout = timeout
+        # environment of LSF commands, the environment of the scheduler by default
+        self.env = env
+
+    @abc.abstractmethod
+    def submit(self, requests):
+        # requests is a list of (bsub options, command). returns job ids in the same order, '0' if failed.
+        pass
+
+    @abc.abstractmethod
+    def status(self, jobids, fields=('jobid', 'stat', 'exit_code')):
+        # returns {jobid: record}, all jobs of the user when jobids is None
+        pass
+
+    @abc.abstractmethod
+    def kill(self, jobids, timeout=None):
+        # returns {jobid: message like bkill}
+        pass
+
+    @abc.abstractmethod
+    def queues(self, fields=('queue_name',)):
+        # returns a list of queue records
+        pass
+
+    @abc.abstractmethod
+    def peek(self, jobid):
+        # returns the output of a running job so far
+        pass
+
+
+class CLITransport(Transport):
+    """
+    runs LSF commands, with -json output where LSF supports it
+    """
+
+    def __init__(self, log, timeout, env=None):
+        super().__init__(log, timeout, env=env)
+        # requests are submitted by `bsub -pack` until the cluster rejects job packs
+        self.pack = True
+
+    def submit(self, requests):
+        if len(requests) > 1 and self.pack:
+            jobids = bsub_pack(requests, self.log, timeout=self.timeout, env=self.env)
+            if jobids is not None:
+                return jobids
+            self.log.warning('[ LSF ] job packs are not enabled, set LSB_MAX_PACK_JOBS in lsf.conf. jobs are submitted one by one')
+            self.pack = False
+
+        return [bsub(options, cmd, self.log, timeout=self.timeout, env=self.env) for options, cmd in requests]
+
+    def status(self, jobids, fields=('jobid', 'stat', 'exit_code')):
+        return bjobs(jobids, self.log, fields=fields, timeout=self.timeout, env=self.env)
 
-    reply = run_cmd(cmd, log)
-    log.info(f'[ LSF ] reply: {reply}')
+    def kill(self, jobids, timeout=None):
+        return bkill(jobids, self.log, timeout=timeout or self.timeout, env=self.env)
 
-    stat = reply
-    if reply is not None:
-        stat = reply.strip()
+    def queues(self, fields=('queue_name',)):
+        return bqueues(self.log, fields, timeout=self.timeout, env=self.env)
 
-    return stat
+    def peek(self, jobid):
+        return bpeek(jobid, self.log, timeout=self.timeout, env=self.env)
 
-def bsub(options, cmd, log):
-    # DEBUG: submit to local host for test
-    bsub_cmd = ['bsub', '-m', 'scurvily1']
+
+class PythonLSFTransport(CLITransport):
+    """
+    calls LSF API in process by pythonlsf, without forking LSF commands.
+    requests and fields which are not supported by the API wrapper go through LSF commands.
+    """
+
+    STATUS_FIELDS = {'jobid', 'stat', 'exit_code', 'job_name', 'queue'}
+
+    def __init__(self, log, timeout):
+        super().__init__(log, timeout)
+        if lsfapi.lsb_init('airflow') != 0:
+            raise RuntimeError('failed to initialize LSF API')
+        # LSF API is not thread safe
+        self.lock = threading.Lock()
+
+    def submit(self, requests):
+        jobids = []
+        for options, cmd in requests:
+            req = self.submit_request(options, cmd)
+            if req is None:
+                jobids.extend(super().submit([(options, cmd)]))
+                continue
+
+            with self.lock:
+                jobid = lsfapi.lsb_submit(req, lsfapi.submitReply())
+                if jobid < 0:
+                    self.log.warning(f'[ LSF ] error: failed to submit job: {lsfapi.lsb_sysmsg()}')
+            jobids.append(str(max(jobid, 0)))
+
+        return jobids
+
+    def submit_request(self, options, cmd):
+        req = lsfapi.submit()
+        req.options = 0
+        req.options2 = 0
+        req.command = shlex.join(cmd)
+        req.beginTime = 0
+        req.termTime = 0
+        req.numProcessors = 1
+        req.maxNumProcessors = 1
+        limits = [lsfapi.DEFAULT_RLIMIT] * lsfapi.LSF_RLIM_NLIMITS
+
+        i = 0
+        while i < len(options):
+            option, value = options[i], options[i + 1] if i + 1 < len(options) else None
+            i += 2
+            if option == '-J':
+                req.jobName = value
+                req.options |= lsfapi.SUB_JOB_NAME
+            elif option == '-q':
+                req.queue = value
+                req.options |= lsfapi.SUB_QUEUE
+            elif option == '-w':
+                req.dependCond = value
+                req.options |= lsfapi.SUB_DEPEND_COND
+            elif option == '-R':
+                req.resReq = value
+                req.options |= lsfapi.SUB_RES_REQ
+            elif option == '-o':
+                req.outFile = value
+                req.options |= lsfapi.SUB_OUT_FILE
+            elif option == '-e':
+                req.errFile = value
+                req.options |= lsfapi.SUB_ERR_FILE
+            elif option == '-n' and value.isdigit():
+                req.numProcessors = req.maxNumProcessors = int(value)
+            elif option == '-M' and re.fullmatch(r'\d+MB', value):
+                # the limit is in KB. a number without unit is left to bsub and LSF_UNIT_FOR_LIMITS
+                limits[lsfapi.LSF_RLIMIT_RSS] = int(value[:-2]) * 1024
+            elif option == '-W':
+                limits[lsfapi.LSF_RLIMIT_RUN] = run_limit_seconds(value)
+            else:
+                return None
+
+        req.rLimits = limits
+        return req
+
+    def status(self, jobids, fields=('jobid', 'stat', 'exit_code')):
+        if not set(fields) <= self.STATUS_FIELDS:
+            return super().status(jobids, fields)
+
+        # all jobs of the user are read at once, and the asked ones are kept
+        records = {}
+        with self.lock:
+            self.read_jobs(fields, records, None if jobids is None else set(jobids))
+        for jid in jobids or ():
+            if jid not in records:
+                records[jid] = {'JOBID': jid, 'ERROR': f'Job <{jid}> is not found'}
+
+        return records
+
+    def read_jobs(self, fields, records, jobids=None):
+        count = lsfapi.lsb_openjobinfo(0, None, None, None, None, lsfapi.ALL_JOB)
+        if count <= 0:
+            lsfapi.lsb_closejobinfo()
+            return
+
+        more = lsfapi.new_intp()
+        lsfapi.intp_assign(more, count)
+        for _ in range(count):
+            job = lsfapi.lsb_readjobinfo(more)
+            if jobids is not None and str(job.jobId) not in jobids:
+                continue
+            values = {
+                'jobid': str(job.jobId),
+                'stat': job_stat(job.status),
+                'exit_code': str(job.exitStatus >> 8) if job_stat(job.status) == 'EXIT' else '',
+                'job_name': job.submit.jobName,
+                'queue': job.submit.queue,
+            }
+            records[values['jobid']] = {field.upper(): values[field] for field in fields}
+        lsfapi.lsb_closejobinfo()
+
+    def kill(self, jobids, timeout=None):
+        # all jobs are killed by one request. the API tells no outcome of each job, so a failed
+        # request, or a wrapper without the job id array, goes through bkill for the outcomes.
+        if not jobids or not hasattr(lsfapi, 'new_LS_LONG_INTArray'):
+            return super().kill(jobids, timeout)
+
+        req = lsfapi.signalBulkJobs()
+        req.signal = signal.SIGKILL
+        req.njobs = len(jobids)
+        req.jobs = lsfapi.new_LS_LONG_INTArray(len(jobids))
+        req.flags = 0
+        for i, jid in enumerate(jobids):
+            lsfapi.LS_LONG_INTArray_setitem(req.jobs, i, int(jid))
+        with self.lock:
+            killed = lsfapi.lsb_killbulkjobs(req) == 0
+            if not killed:
+                self.log.warning(f'[ LSF ] error: failed to kill jobs: {lsfapi.lsb_sysmsg()}')
+        lsfapi.delete_LS_LONG_INTArray(req.jobs)
+
+        if not killed:
+            return super().kill(jobids, timeout)
+        return {jid: 'is being terminated' for jid in jobids}
+
+
+class FakeTransport(Transport):
+    """
+    in-memory LSF for tests. a job pends for pend_time seconds and runs for run_time seconds.
+    """
+
+    def __init__(self, log, timeout, pend_time=0, run_time=1, queue_names=('normal',)):
+        super().__init__(log, timeout)
+        self.pend_time = pend_time
+        self.run_time = run_time
+        self.queue_names = queue_names
+        self.lock = threading.Lock()
+        # jobid -> (job name, queue, submit time, killed)
+        self.jobs = {}
+        self.next_jobid = 1
+
+    def submit(self, requests):
+        jobids = []
+        with self.lock:
+            for options, _ in requests:
+                options = dict(zip(options[::2], options[1::2]))
+                jobid = str(self.next_jobid)
+                self.next_jobid += 1
+                self.jobs[jobid] = (options.get('-J', ''), options.get('-q', self.queue_names[0]), time.monotonic(), False)
+                jobids.append(jobid)
+
+        return jobids
+
+    def stat(self, jobid, now):
+        _, _, submitted, killed = self.jobs[jobid]
+        if killed:
+            return 'EXIT'
+        if now < submitted + self.pend_time:
+            return 'PEND'
+        if now < submitted + self.pend_time + self.run_time:
+            return 'RUN'
+        return 'DONE'
+
+    def status(self, jobids, fields=('jobid', 'stat', 'exit_code')):
+        now = time.monotonic()
+        records = {}
+        with self.lock:
+            for jid in self.jobs if jobids is None else jobids:
+                if jid not in self.jobs:
+                    records[jid] = {'JOBID': jid, 'ERROR': f'Job <{jid}> is not found'}
+                    continue
+
+                name, queue, _, _ = self.jobs[jid]
+                stat = self.stat(jid, now)
+                values = {'jobid': jid, 'stat': stat, 'job_name': name, 'queue': queue,
+                    'exit_code': '130' if stat == 'EXIT' else ''}
+                records[jid] = {field.upper(): values.get(field, '') for field in fields}
+
+        return records
+
+    def kill(self, jobids, timeout=None):
+        now = time.monotonic()
+        outcomes = {}
+        with self.lock:
+            for jid in jobids:
+                if jid not in self.jobs:
+                    outcomes[jid] = 'No matching job found'
+                elif self.stat(jid, now) in ('DONE', 'EXIT'):
+                    outcomes[jid] = 'Job has already finished'
+                else:
+                    self.jobs[jid] = self.jobs[jid][:3] + (True,)
+                    outcomes[jid] = 'is being terminated'
+
+        return outcomes
+
+    def queues(self, fields=('queue_name',)):
+        records = []
+        for name in self.queue_names:
+            values = {'queue_name': name, 'status': 'Open:Active', 'max': '-', 'njobs': '0', 'pend': '0', 'run': '0'}
+            records.append({field.upper(): values.get(field, '') for field in fields})
+
+        return records
+
+    def peek(self, jobid):
+        return None
+
+def make_transport(name, log, timeout, env=None):
+    if name == 'fake':
+        return FakeTransport(log, timeout)
+
+    if name == 'pythonlsf':
+        # LSF API is initialized once per process, by the environment of the scheduler
+        if env is not None:
+            log.warning('[ LSF ] pythonlsf cannot reach several clusters, LSF commands are used instead')
+        elif lsfapi is not None:
+            return PythonLSFTransport(log, timeout)
+        else:
+            log.warning('[ LSF ] pythonlsf is not installed, LSF commands are used instead')
+
+    return CLITransport(log, timeout, env=env)
+
+def poll_intervals(value):
+    # 'PEND:10:120,RUN:5:60' -> {'PEND': (10, 120), 'RUN': (5, 60)}, (first, longest) seconds by status
+    intervals = {}
+    for item in value.split(','):
+        if item.strip():
+            stat, first, longest = item.strip().split(':')
+            intervals[stat.strip().upper()] = (float(first), float(longest))
+
+    return intervals
+
+def lsf_conf(name, env=None):
+    # value of a parameter in lsf.conf of the cluster, None if it is not set or not readable
+    path = os.path.join((env or os.environ).get('LSF_ENVDIR', '/etc'), 'lsf.conf')
+    value = None
+    try:
+        with open(path) as f:
+            for line in f:
+                key, sep, found = line.partition('=')
+                if sep and key.strip() == name:
+                    value = found.strip().strip('"')
+    except OSError:
+        return None
+
+    return value
+
+def cluster_env(cluster):
+    # environment of LSF commands of a cluster profile
+    env = dict(os.environ)
+    if cluster.get('envdir'):
+        env['LSF_ENVDIR'] = cluster['envdir']
+    if cluster.get('serverdir'):
+        env['LSF_SERVERDIR'] = cluster['serverdir']
+    if cluster.get('bindir'):
+        env['LSF_BINDIR'] = cluster['bindir']
+        env['PATH'] = cluster['bindir'] + os.pathsep + env.get('PATH', '')
+
+    return env
+
+def run_limit_seconds(limit):
+    # [hour:]minute
+    parts = [int(p) for p in limit.split(':')]
+    return parts[0] * 60 if len(parts) == 1 else parts[0] * 3600 + parts[1] * 60
+
+
+def bkill(jobids, log, message='job is killed because airflow is ended', timeout=5, env=None):
+    # returns {jobid: message of bkill} for the given jobs
+    outcomes = {}
+    for chunk in chunks(jobids, JOBID_CHUNK_SIZE):
+        cmd = ['bkill', '-C', message] + chunk
+        log.debug('[ LSF ] request: bkill for %d jobs', len(chunk))
+
+        reply = run_cmd(cmd, log, timeout=timeout, env=env)
+        for jid, outcome in re.findall(r'Job <(\d+)>:? *(.*)', reply or ''):
+            outcomes[jid] = outcome.strip()
+
+        for jid in chunk:
+            outcomes.setdefault(jid, 'no reply from bkill' if reply is not None else 'bkill is timed out')
+
+    return outcomes
+
+def kill_result(outcome):
+    if outcome.startswith('is being') or 'signal' in outcome:
+        return 'killed'
+    if 'already finished' in outcome or 'No matching job' in outcome:
+        return 'finished'
+
+    return 'failed'
+
+def bjobs(jobids, log, fields=('jobid', 'stat', 'exit_code'), timeout=5, env=None):
+    # returns {jobid: record}. jobs unknown by LSF have an 'ERROR' in their record.
+    # jobs in a chunk which fails to be queried are not in the result.
+    # all jobs of the user are queried when jobids is None
+    records = {}
+    batches = chunks(jobids, JOBID_CHUNK_SIZE) if jobids is not None else [['-a']]
+    for chunk in batches:
+        cmd = ['bjobs', '-o', ' '.join(fields), '-json'] + chunk
+        log.debug('[ LSF ] request: bjobs for %d jobs', len(chunk))
+
+        reply = run_cmd(cmd, log, timeout=timeout, env=env)
+        for record in parse_json_records(reply, log):
+            if 'JOBID' in record:
+                records[record['JOBID']] = record
+
+    return records
+
+def bqueues(log, fields=('queue_name',), timeout=5, env=None):
+    cmd = ['bqueues', '-o', ' '.join(fields), '-json']
+    log.debug('[ LSF ] request: %s', cmd)
+
+    return parse_json_records(run_cmd(cmd, log, timeout=timeout, env=env), log)
+
+def bpeek(jobid, log, timeout=5, env=None):
+    log.debug('[ LSF ] request: bpeek %s', jobid)
+    return run_cmd(['bpeek', jobid], log, timeout=timeout, env=env)
+
+def bsub(options, cmd, log, timeout=5, env=None):
+    bsub_cmd = ['bsub']
     bsub_cmd.extend(options)
     bsub_cmd.extend(cmd)
-    log.info(f'[ LSF ] request: {bsub_cmd}')
+    log.debug('[ LSF ] request: %s', bsub_cmd)
 
-    message = run_cmd(bsub_cmd, log)
-    log.info(f'[ LSF ] reply: {message}')
+    message = run_cmd(bsub_cmd, log, timeout=timeout, env=env)
+    log.debug('[ LSF ] reply: %s', message)
 
     # record job information for monitoring
     jobid = '0'
-    result = re.search(r'<(\d*)>', message)
+    result = re.search(r'<(\d*)>', message or '')
     if result:
         jobid = result.group(1)
     else:
-        log.info(f'[ LSF ] error: failed to get jobid {message}')
+        log.warning(f'[ LSF ] error: failed to get jobid {message}')
 
     return jobid 
 
+def bsub_pack(requests, log, timeout=5, env=None):
+    # requests is a list of (options, command). returns job ids in the same order,
+    # '0' for a request which is failed to be submitted, None if job packs are not enabled.
+    # jobs of one pack share a job description, so that they can be found when bsub has no reply
+    pack = f'airflow-pack-{uuid.uuid4().hex}'
+    with tempfile.NamedTemporaryFile('w', prefix='airflow-lsf-', suffix='.pack', delete=False) as f:
+        for options, cmd in requests:
+            f.write(shlex.join(['-Jd', pack] + options + list(cmd)) + '\n')
 
-def run_cmd(cmd, log):
-    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
     try:
-        outs, errs = proc.communicate(timeout=5)
-        log.info(f'[ LSF ] stdout: {outs}')
-        log.info(f'[ LSF ] stderr: {errs}')
-    except TimeoutExpired:
+        log.debug('[ LSF ] request: bsub -pack with %d jobs', len(requests))
+        message = run_cmd(['bsub', '-pack', f.name], log, timeout=timeout, env=env)
+    finally:
+        os.unlink(f.name)
+
+    submitted = re.findall(r'Job <(\d+)> is submitted', message or '')
+    if len(submitted) == len(requests):
+        return submitted
+    if not submitted and message is not None and PACK_REJECTED.search(message):
+        return None
+
+    # some requests are rejected, or bsub is timed out after LSF accepted some of them.
+    # map the submitted jobs back by their job names.
+    names = {}
+    if message is not None:
+        log.warning(f'[ LSF ] {len(requests) - len(submitted)} of {len(requests)} jobs are not submitted: {message}')
+        records = bjobs(submitted, log, fields=('jobid', 'job_name'), timeout=timeout, env=env)
+    else:
+        log.warning(f'[ LSF ] no reply of bsub -pack, looking for the jobs of pack {pack}')
+        records = bjobs(None, log, fields=('jobid', 'job_name', 'job_description'), timeout=timeout, env=env)
+        records = {jid: record for jid, record in records.items() if record.get('JOB_DESCRIPTION') == pack}
+
+    for record in records.values():
+        names[record.get('JOB_NAME')] = record['JOBID']
+
+    return [names.get(job_name(options), '0') for options, _ in requests]
+
+@functools.lru_cache(maxsize=1024)
+def resource_options(config):
+    # bsub options of the resources in executor_config['lsf'], given as json so that
+    # the options are built once for each distinct config
+    lsf_config = json.loads(config)
+    options = []
+    if 'cores' in lsf_config:
+        options.extend(['-n', str(lsf_config['cores'])])
+    if 'runtime' in lsf_config:
+        # minutes or [hour:]minute
+        options.extend(['-W', str(lsf_config['runtime'])])
+
+    requirements = []
+    if 'memory' in lsf_config:
+        # a number in the unit of LSF_UNIT_FOR_LIMITS, KB by default, or with a unit like '8GB'
+        requirements.append(f"rusage[mem={lsf_config['memory']}]")
+        options.extend(['-M', str(lsf_config['memory'])])
+    for name in ('span', 'affinity'):
+        if name in lsf_config:
+            value = str(lsf_config[name])
+            requirements.append(value if value.startswith(f'{name}[') else f'{name}[{value}]')
+    if requirements:
+        options.extend(['-R', ' '.join(requirements)])
+
+    gpu = lsf_config.get('gpu')
+    # number of GPUs, true for one, or a full -gpu requirement like "num=2:mode=exclusive_process"
+    if gpu is True:
+        options.extend(['-gpu', 'num=1'])
+    elif isinstance(gpu, int) and not isinstance(gpu, bool):
+        options.extend(['-gpu', f'num={gpu}'])
+    elif gpu:
+        options.extend(['-gpu', str(gpu)])
+
+    return tuple(options)
+
+def memory_mb(value):
+    # like '12 Mbytes' or '1.5 Gbytes'
+    result = re.match(r'([\d.]+)\s*([KMGT]?)', value or '')
+    if not result:
+        return None
+
+    return float(result.group(1)) * {'K': 1 / 1024, '': 1, 'M': 1, 'G': 1024, 'T': 1024 * 1024}[result.group(2)]
+
+def seconds(value):
+    # like '35 second(s)' or '00:01:02.50'
+    if not value or value == '-':
+        return None
+    if ':' in value:
+        return sum(float(part) * 60 ** i for i, part in enumerate(reversed(value.split(':'))))
+
+    result = re.match(r'[\d.]+', value)
+    return float(result.group()) if result else None
+
+def task_log_path(root, dag_id, run_id, task_id, map_index, try_number):
+    # the same layout as the default log_filename_template of Airflow
+    path = os.path.join(root, f'dag_id={dag_id}', f'run_id={run_id}', f'task_id={task_id}')
+    if map_index >= 0:
+        path = os.path.join(path, f'map_index={map_index}')
+
+    return os.path.join(path, f'attempt={try_number}.log')
+
+def task_ident(key):
+    return (key.dag_id, key.run_id, key.task_id)
+
+def eager_candidate(task):
+    # tasks which are not run by the executor, or need the scheduler to be expanded
+    if task.trigger_rule != 'all_success' or getattr(task, 'is_mapped', False):
+        return False
+    if getattr(task, 'inherits_from_empty_operator', False) or task.task_type in ('DummyOperator', 'EmptyOperator'):
+        return False
+
+    return True
+
+def task_job_name(key):
+    return f'{key.dag_id}-{key.task_id}-{key.run_id}'
+
+def job_name(options):
+    return option_value(options, '-J')
+
+def option_value(options, option):
+    if option in options:
+        return options[options.index(option) + 1]
+
+    return None
+
+
+def run_cmd(cmd, log, timeout=5, env=None):
+    # returns the output of the command, or None if the command cannot be run in time
+    start = time.monotonic()
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env)
+    except OSError as e:
+        log.error(f'[ LSF ] error: failed to run {cmd[0]}: {e}')
+        Stats.incr(f'lsf_executor.cmd.{cmd[0]}.errors')
+        return None
+
+    try:
+        outs, errs = proc.communicate(timeout=timeout)
+        log.debug('[ LSF ] stdout: %s', outs)
+    except subprocess.TimeoutExpired:
+        log.warning(f'[ LSF ] error: {cmd[0]} is timed out after {timeout} seconds')
+        Stats.incr(f'lsf_executor.cmd.{cmd[0]}.timeouts')
         proc.kill()
-        outs, errs = proc.communicate()
-    
+        proc.communicate()
+        return None
+    finally:
+        Stats.timing(f'lsf_executor.cmd.{cmd[0]}', (time.monotonic() - start) * 1000)
+
+    if proc.returncode != 0:
+        Stats.incr(f'lsf_executor.cmd.{cmd[0]}.errors')
+
     result = outs.decode('utf-8')
     return result
 
 
+def parse_json_records(reply, log):
+    if not reply:
+        return []
+
+    # stderr is merged into stdout, skip any message before the json document
+    start = reply.find('{')
+    if start < 0:
+        log.warning(f'[ LSF ] error: unexpected reply {reply}')
+        return []
+
+    try:
+        return json.loads(reply[start:]).get('RECORDS', [])
+    except ValueError:
+        log.warning(f'[ LSF ] error: failed to parse reply {reply}')
+        return []
+
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
 # Defining the plugin class
 class LSFExecutorPlugin(AirflowPlugin):
     name = "LSF"
-    executors = [LSFExecutor]
+    executors = [LSFExecutor, ShardedLSFExecutor]
 
 
 # DEBUG: test only
@@ -155,8 +2065,8 @@ if __name__ == '__main__':
     cmd = ['sleep', '9527']
     jid = bsub([], cmd, e.log)
 
-    stat = bjobs(jid, e.log)
+    stat = bjobs([jid], e.log).get(jid, {}).get('STAT')
     e.log.info(f'status is <{stat}>')
 
-    bkill(jid, e.log)
+    bkill([jid], e.log)
 
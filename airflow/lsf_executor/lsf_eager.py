@@ -0,0 +1,88 @@
+#!/bin/python3
+#
+# Copyright International Business Machines Corp, 2022
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Wrapper of a task submitted eagerly by the LSF executor. LSF starts the job right
+# after its upstream jobs, usually before the scheduler queues the task. The wrapper
+# waits until the scheduler queues the task instance and records this job as its
+# external executor id, then runs the task command in place of itself.
+#
+# It exits with 1 without running the task when the task instance is finished in
+# another way, or is not queued with this job in --timeout seconds.
+
+import os
+import sys
+import time
+import argparse
+
+from airflow.models.taskinstance import TaskInstance
+from airflow.utils.session import create_session
+
+# states of a task instance which the scheduler can still queue
+WAITING = (None, 'scheduled')
+QUEUED = ('queued', 'running')
+
+
+def task_state(dag_id, task_id, run_id, map_index):
+    with create_session() as session:
+        return session.query(TaskInstance.state, TaskInstance.external_executor_id).filter(
+            TaskInstance.dag_id == dag_id,
+            TaskInstance.task_id == task_id,
+            TaskInstance.run_id == run_id,
+            TaskInstance.map_index == map_index,
+        ).one_or_none()
+
+def main():
+    parser = argparse.ArgumentParser(description='runs an eagerly submitted task once the scheduler queues it')
+    parser.add_argument('dag_id')
+    parser.add_argument('task_id')
+    parser.add_argument('run_id')
+    parser.add_argument('--map-index', type=int, default=-1)
+    parser.add_argument('--timeout', type=float, default=600, help='seconds to wait for the scheduler')
+    parser.add_argument('--poll-interval', type=float, default=2, help='seconds between checks of the task instance')
+    # the task command follows --
+    argv = sys.argv[1:]
+    if '--' not in argv or argv[-1] == '--':
+        parser.error('the task command is not given after --')
+    args = parser.parse_args(argv[:argv.index('--')])
+    command = argv[argv.index('--') + 1:]
+
+    jobid = os.getenv('LSB_JOBID')
+    deadline = time.monotonic() + args.timeout
+    while True:
+        found = task_state(args.dag_id, args.task_id, args.run_id, args.map_index)
+        if found is None:
+            print('[ LSF eager ] task instance is not found', flush=True)
+            return 1
+
+        state, external_id = found
+        # job ids of a cluster shard are prefixed by the cluster name. the external id
+        # can be of an earlier try until the scheduler records this job.
+        if state in QUEUED and (external_id or '').split(':')[-1] == jobid:
+            break
+        if state not in WAITING and state not in QUEUED:
+            print(f'[ LSF eager ] task is {state}', flush=True)
+            return 1
+        if time.monotonic() > deadline:
+            print(f'[ LSF eager ] task is not queued in {args.timeout} seconds', flush=True)
+            return 1
+        time.sleep(args.poll_interval)
+
+    print(f'[ LSF eager ] running task: {command}', flush=True)
+    os.execvp(command[0], command)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,97 @@
+#!/bin/python3
+#
+# Copyright International Business Machines Corp, 2022
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Pilot worker of the LSF executor. It runs as a long-lived LSF job and pulls task
+# commands from a spool directory shared with the Airflow scheduler:
+#
+#   queue/<task>.json            task written by the executor: {"command": [...]}
+#   running/<jobid>/<task>.json  task claimed by the pilot job <jobid>
+#   done/<task>.json             result of the task: {"rc": exit code}
+#   stop                         all pilots exit when this file exists
+#
+# A task is claimed by renaming it, so every task is run by one pilot only.
+# The pilot exits when there is no task for --idle-timeout seconds.
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+
+def claim(spool, running):
+    queue = os.path.join(spool, 'queue')
+    for name in sorted(os.listdir(queue)):
+        if not name.endswith('.json'):
+            continue
+
+        claimed = os.path.join(running, name)
+        try:
+            os.rename(os.path.join(queue, name), claimed)
+        except OSError:
+            # claimed by another pilot
+            continue
+
+        return claimed
+
+    return None
+
+def run_task(spool, claimed):
+    with open(claimed) as f:
+        task = json.load(f)
+
+    name = os.path.basename(claimed)
+    print(f'[ LSF pilot ] running task {name[:-len(".json")]}: {task["command"]}', flush=True)
+    try:
+        rc = subprocess.call(task['command'])
+    except OSError as e:
+        print(f'[ LSF pilot ] error: {e}', flush=True)
+        rc = 127
+
+    tmp = os.path.join(spool, 'done', '.' + name)
+    with open(tmp, 'w') as f:
+        json.dump({'rc': rc, 'pilot': os.getenv('LSB_JOBID')}, f)
+    os.rename(tmp, os.path.join(spool, 'done', name))
+    os.unlink(claimed)
+
+def main():
+    parser = argparse.ArgumentParser(description='pilot worker of the Airflow LSF executor')
+    parser.add_argument('spool', help='spool directory shared with the Airflow scheduler')
+    parser.add_argument('--idle-timeout', type=float, default=60, help='seconds without task before exiting')
+    parser.add_argument('--poll-interval', type=float, default=0.2, help='seconds between checks of the queue')
+    args = parser.parse_args()
+
+    running = os.path.join(args.spool, 'running', os.getenv('LSB_JOBID', str(os.getpid())))
+    os.makedirs(running, exist_ok=True)
+
+    idle_since = time.monotonic()
+    while not os.path.exists(os.path.join(args.spool, 'stop')):
+        claimed = claim(args.spool, running)
+        if claimed is None:
+            if time.monotonic() - idle_since > args.idle_timeout:
+                break
+            time.sleep(args.poll_interval)
+            continue
+
+        run_task(args.spool, claimed)
+        idle_since = time.monotonic()
+
+    os.rmdir(running)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,299 @@
+#!/bin/python3
+#
+# Copyright International Business Machines Corp, 2022
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# A fake LSF cluster for testing the Airflow LSF executor without a real cluster.
+# bsub, bjobs, bkill and bqueues in this directory are backed by a sqlite state file.
+# The status of a job is computed from its submit time, so nothing runs in the background.
+#
+# environment variables:
+#   LSF_SIM_STATE         state file, default lsfsim.db in LSF_ENVDIR if set, /tmp/lsfsim.db otherwise
+#   LSF_SIM_LATENCY       seconds each command takes, default 0
+#   LSF_SIM_PEND_TIME     average seconds a job is pending, default 1
+#   LSF_SIM_RUN_TIME      average seconds a job is running, default 5
+#   LSF_SIM_FAILURE_RATE  fraction of jobs which exit with failure, default 0
+#   LSF_SIM_REJECT_RATE   fraction of submissions which are rejected, default 0
+#   LSF_SIM_QUEUES        queue names, the first one is the default queue, default normal,short
+#   LSF_SIM_PACK          0 to reject `bsub -pack` like a cluster without LSB_MAX_PACK_JOBS, default 1
+
+import os
+import re
+import sys
+import json
+import time
+import shlex
+import random
+import sqlite3
+
+# bsub options with a value
+BSUB_OPTIONS = {'-J', '-Jd', '-q', '-m', '-o', '-e', '-n', '-R', '-M', '-W', '-w', '-gpu', '-P', '-G', '-app', '-u', '-user'}
+
+def env(name, default):
+    return type(default)(os.getenv(name, default))
+
+def connect():
+    # one state per cluster profile of the executor
+    default = os.path.join(os.environ['LSF_ENVDIR'], 'lsfsim.db') if os.getenv('LSF_ENVDIR') else '/tmp/lsfsim.db'
+    db = sqlite3.connect(env('LSF_SIM_STATE', default), timeout=60)
+    db.execute('''CREATE TABLE IF NOT EXISTS jobs (
+        jobid INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT, queue TEXT, command TEXT, options TEXT,
+        submit REAL, pend REAL, run REAL, failed INTEGER, killed REAL)''')
+    return db
+
+def queues():
+    return env('LSF_SIM_QUEUES', 'normal,short').split(',')
+
+
+class Job:
+    def __init__(self, row):
+        (self.jobid, self.name, self.queue, self.command, options,
+            self.submit, self.pend, self.run, self.failed, self.killed) = row
+        self.options = json.loads(options)
+        # jobs in `-w "done(id) && ..."`, resolved by load_jobs()
+        self.depend = re.findall(r'done\((\d+)\)', self.options.get('-w', ''))
+        self.depend_jobs = []
+
+    def orphaned(self):
+        # a dependency which exits is never satisfied. with -ti the job exits at once.
+        for job in self.depend_jobs:
+            if job.exited() or job.orphaned():
+                return True
+        return False
+
+    def start_time(self):
+        start = self.submit + self.pend
+        for job in self.depend_jobs:
+            start = max(start, job.end_time() + self.pend)
+        return float('inf') if self.orphaned() else start
+
+    def end_time(self):
+        end = self.start_time() + self.run
+        limit = self.options.get('-W')
+        if limit is not None:
+            end = min(end, self.start_time() + run_limit(limit))
+        return end
+
+    def exited(self):
+        limit = self.options.get('-W')
+        return self.failed or self.orphaned() or (limit is not None and self.run > run_limit(limit))
+
+    def stat(self, now):
+        if self.killed is not None and self.killed <= now and self.killed < self.end_time():
+            return 'EXIT'
+        if self.orphaned() and '-ti' in self.options and max(job.end_time() for job in self.depend_jobs) <= now:
+            return 'EXIT'
+        if now < self.start_time():
+            return 'PEND'
+        if now < self.end_time():
+            return 'RUN'
+        return 'EXIT' if self.exited() else 'DONE'
+
+    def record(self, fields, now):
+        stat = self.stat(now)
+        started = stat != 'PEND' and self.start_time() <= now
+        finished = stat in ('DONE', 'EXIT')
+        end = min(self.end_time(), self.killed or self.end_time())
+        run_time = int((end if finished else now) - self.start_time()) if started else 0
+
+        values = {
+            'jobid': str(self.jobid),
+            'stat': stat,
+            'job_name': self.name,
+            'queue': self.queue,
+            'job_description': self.options.get('-Jd', ''),
+            'exit_code': '1' if stat == 'EXIT' else '',
+            'exit_reason': ('killed by owner' if self.killed is not None else 'non-zero exit') if stat == 'EXIT' else '',
+            'pend_time': str(int((self.start_time() if started else now) - self.submit)),
+            'run_time': f'{run_time} second(s)',
+            'cpu_used': f'{run_time * 0.9:.1f} second(s)',
+            'max_mem': f'{64 + self.jobid % 512} Mbytes' if started else '',
+            'mem': f'{32 + self.jobid % 256} Mbytes' if started and not finished else '',
+            'memlimit': self.options.get('-M', ''),
+        }
+        return {field.upper(): values.get(field, '') for field in fields}
+
+def run_limit(limit):
+    # [hour:]minute
+    parts = [int(p) for p in limit.split(':')]
+    return parts[0] * 60 if len(parts) == 1 else parts[0] * 3600 + parts[1] * 60
+
+def load_jobs(db, jobids=None):
+    jobs = {str(row[0]): Job(row) for row in select_jobs(db, jobids)}
+
+    # load the jobs which others depend on
+    loaded = dict(jobs)
+    searched = set(loaded)
+    missing = {jid for job in jobs.values() for jid in job.depend} - searched
+    while missing:
+        searched |= missing
+        for row in select_jobs(db, list(missing)):
+            loaded[str(row[0])] = Job(row)
+        missing = {jid for job in loaded.values() for jid in job.depend} - searched
+
+    for job in loaded.values():
+        job.depend_jobs = [loaded[jid] for jid in job.depend if jid in loaded]
+
+    return jobs
+
+def select_jobs(db, jobids):
+    if jobids is None:
+        return list(db.execute('SELECT * FROM jobs'))
+
+    rows = []
+    for i in range(0, len(jobids), 500):
+        chunk = jobids[i:i + 500]
+        rows.extend(db.execute(f'SELECT * FROM jobs WHERE jobid IN ({",".join("?" * len(chunk))})', chunk))
+    return rows
+
+
+def parse_bsub(args):
+    options = {}
+    i = 0
+    while i < len(args) and args[i].startswith('-'):
+        if args[i] in BSUB_OPTIONS:
+            options[args[i]] = args[i + 1]
+            i += 2
+        else:
+            options[args[i]] = True
+            i += 1
+    return options, args[i:]
+
+def submit(db, args, now):
+    options, command = parse_bsub(args)
+    if not command:
+        return 'Job not submitted: no command is specified.'
+
+    if random.random() < env('LSF_SIM_REJECT_RATE', 0.0):
+        return 'Request aborted by esub. Job not submitted.'
+
+    queue = options.get('-q', queues()[0])
+    if queue not in queues():
+        return f'{queue}: No such queue. Job not submitted.'
+
+    pend = random.uniform(0.5, 1.5) * env('LSF_SIM_PEND_TIME', 1.0)
+    run = random.uniform(0.5, 1.5) * env('LSF_SIM_RUN_TIME', 5.0)
+    failed = random.random() < env('LSF_SIM_FAILURE_RATE', 0.0)
+
+    cursor = db.execute('INSERT INTO jobs (name, queue, command, options, submit, pend, run, failed) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        (options.get('-J', command[0]), queue, shlex.join(command), json.dumps(options), now, pend, run, failed))
+
+    default = '' if '-q' in options else 'default '
+    return f'Job <{cursor.lastrowid}> is submitted to {default}queue <{queue}>.'
+
+def bsub(args):
+    db = connect()
+    now = time.time()
+    with db:
+        if args[:1] == ['-pack']:
+            if not env('LSF_SIM_PACK', 1):
+                return 'Job packs are not enabled. Set LSB_MAX_PACK_JOBS in lsf.conf. Job not submitted.'
+            with open(args[1]) as f:
+                lines = [line for line in f.read().splitlines() if line.strip() and not line.startswith('#')]
+            return '\n'.join(submit(db, shlex.split(line), now) for line in lines)
+
+        return submit(db, args, now)
+
+def bjobs(args):
+    fields = ['jobid', 'user', 'stat', 'queue', 'job_name']
+    as_json = False
+    header = True
+    show_all = False
+    jobids = []
+    i = 0
+    while i < len(args):
+        if args[i] == '-o':
+            fields = args[i + 1].lower().split()
+            i += 1
+        elif args[i] == '-json':
+            as_json = True
+        elif args[i] == '-noheader':
+            header = False
+        elif args[i] == '-a':
+            show_all = True
+        elif not args[i].startswith('-'):
+            jobids.append(args[i])
+        i += 1
+
+    now = time.time()
+    jobs = load_jobs(connect(), jobids or None)
+    if jobids:
+        records = [jobs[jid].record(fields, now) if jid in jobs else {'JOBID': jid, 'ERROR': f'Job <{jid}> is not found'}
+            for jid in jobids]
+    else:
+        records = [job.record(fields, now) for job in jobs.values()
+            if show_all or job.stat(now) not in ('DONE', 'EXIT')]
+
+    if as_json:
+        return json.dumps({'COMMAND': 'bjobs', 'JOBS': len(records), 'RECORDS': records}, indent=2)
+
+    lines = [' '.join(f.upper() for f in fields)] if header else []
+    for record in records:
+        lines.append(record['ERROR'] if 'ERROR' in record else ' '.join(record[f.upper()] or '-' for f in fields))
+    return '\n'.join(lines)
+
+def bkill(args):
+    jobids = [a for a in args if a.isdigit()]
+    db = connect()
+    now = time.time()
+    messages = []
+    with db:
+        jobs = load_jobs(db, jobids)
+        for jid in jobids:
+            if jid not in jobs:
+                messages.append(f'Job <{jid}>: No matching job found')
+            elif jobs[jid].stat(now) in ('DONE', 'EXIT'):
+                messages.append(f'Job <{jid}>: Job has already finished')
+            else:
+                db.execute('UPDATE jobs SET killed = ? WHERE jobid = ?', (now, int(jid)))
+                messages.append(f'Job <{jid}> is being terminated')
+    return '\n'.join(messages)
+
+def bqueues(args):
+    fields = ['queue_name', 'status', 'max', 'njobs', 'pend', 'run']
+    as_json = '-json' in args
+    if '-o' in args:
+        fields = args[args.index('-o') + 1].lower().split()
+
+    now = time.time()
+    counts = {q: {'PEND': 0, 'RUN': 0} for q in queues()}
+    for job in load_jobs(connect()).values():
+        stat = job.stat(now)
+        if job.queue in counts and stat in counts[job.queue]:
+            counts[job.queue][stat] += 1
+
+    records = []
+    for queue, count in counts.items():
+        values = {
+            'queue_name': queue,
+            'status': 'Open:Active',
+            'max': '-',
+            'njobs': str(count['PEND'] + count['RUN']),
+            'pend': str(count['PEND']),
+            'run': str(count['RUN']),
+        }
+        records.append({f.upper(): values.get(f, '') for f in fields})
+
+    if as_json:
+        return json.dumps({'COMMAND': 'bqueues', 'QUEUES': len(records), 'RECORDS': records}, indent=2)
+
+    lines = [] if '-noheader' in args else [' '.join(f.upper() for f in fields)]
+    lines.extend(' '.join(record[f.upper()] for f in fields) for record in records)
+    return '\n'.join(lines)
+
+
+def main(command):
+    time.sleep(env('LSF_SIM_LATENCY', 0.0))
+    print(globals()[command](sys.argv[1:]))
@@ -0,0 +1,42 @@
+import sys
+
+import pytest
+
+pytest.importorskip('airflow.utils.session')
+
+import lsf_eager
+
+
+def run_wrapper(monkeypatch, states, timeout=5):
+    # states of the task instance as (state, external executor id), one per check
+    checks = iter(states)
+    executed = []
+    monkeypatch.setattr(lsf_eager, 'task_state', lambda *args: next(checks))
+    monkeypatch.setattr(lsf_eager.os, 'execvp', lambda file, args: executed.append(args))
+    monkeypatch.setenv('LSB_JOBID', '102')
+    # the command line built by the executor
+    monkeypatch.setattr(sys, 'argv', ['lsf_eager.py', '--timeout', str(timeout), 'process_text', 'say_hi', 'manual__2022-01-13',
+        '--map-index', '-1', '--poll-interval', '0', '--', 'airflow', 'tasks', 'run', 'process_text'])
+
+    return lsf_eager.main(), executed
+
+
+def test_task_runs_when_queued_with_this_job(monkeypatch):
+    rc, executed = run_wrapper(monkeypatch, [(None, None), ('scheduled', '55'), ('queued', '55'), ('queued', 'cluster1:102')])
+    assert rc is None
+    assert executed == [['airflow', 'tasks', 'run', 'process_text']]
+
+def test_task_finished_otherwise_is_not_run(monkeypatch):
+    rc, executed = run_wrapper(monkeypatch, [(None, None), ('upstream_failed', None)])
+    assert rc == 1
+    assert executed == []
+
+def test_task_queued_with_another_job_is_not_run(monkeypatch):
+    rc, executed = run_wrapper(monkeypatch, [('queued', '103')] * 3 + [('success', '103')])
+    assert rc == 1
+    assert executed == []
+
+def test_wrapper_gives_up_waiting(monkeypatch):
+    rc, executed = run_wrapper(monkeypatch, [(None, None)] * 1000, timeout=0)
+    assert rc == 1
+    assert executed == []
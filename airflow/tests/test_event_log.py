@@ -0,0 +1,94 @@
+import logging
+import os
+import shutil
+
+import pytest
+
+pytest.importorskip('airflow.executors.base_executor')
+
+import lsf
+
+EVENTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'lsb.events')
+JOBS = {'101', '102', '103'}
+log = logging.getLogger('test_event_log')
+
+
+def event_lines():
+    with open(EVENTS, 'rb') as f:
+        return f.read().splitlines(keepends=True)
+
+def tracker(tmp_path, replay=True):
+    return lsf.EventTracker(str(tmp_path / 'lsb.events'), str(tmp_path / 'offset.json'), log, replay=replay)
+
+
+def test_replay_recorded_events(tmp_path):
+    shutil.copy(EVENTS, tmp_path / 'lsb.events')
+
+    records = tracker(tmp_path).read(JOBS)
+    assert records == {
+        '101': {'JOBID': '101', 'STAT': 'DONE'},
+        '102': {'JOBID': '102', 'STAT': 'EXIT'},
+        '103': {'JOBID': '103', 'STAT': 'PSUSP'},
+    }
+
+def test_job_finish_after_host_lists():
+    lines = [line for line in event_lines() if line.startswith(b'"JOB_FINISH"')]
+
+    # 2 asked hosts and 1 execution host, quoted strings with spaces before them
+    assert lsf.parse_event(lines[0].rstrip(), JOBS) == {'JOBID': '101', 'STAT': 'DONE'}
+    # no asked host, an execution host per slot
+    assert lsf.parse_event(lines[1].rstrip(), JOBS) == {'JOBID': '102', 'STAT': 'EXIT'}
+    # jobs which are not tracked are skipped without parsing
+    assert lsf.parse_event(lines[0].rstrip(), {'102'}) is None
+
+def test_truncated_job_finish_is_skipped():
+    line = [line for line in event_lines() if line.startswith(b'"JOB_FINISH"')][0]
+    assert lsf.parse_event(line[:120], JOBS) is None
+
+def test_partial_record_is_read_when_completed(tmp_path):
+    lines = event_lines()
+    finish = lines[-2]
+    path = tmp_path / 'lsb.events'
+    path.write_bytes(b''.join(lines[:5]) + finish[:40])
+
+    events = tracker(tmp_path)
+    assert events.read(JOBS) == {'101': {'JOBID': '101', 'STAT': 'RUN'}, '102': {'JOBID': '102', 'STAT': 'RUN'}}
+
+    with open(path, 'ab') as f:
+        f.write(finish[40:])
+    assert events.read(JOBS) == {'101': {'JOBID': '101', 'STAT': 'DONE'}}
+    assert events.read(JOBS) == {}
+
+def test_offset_is_kept_across_restarts(tmp_path):
+    lines = event_lines()
+    path = tmp_path / 'lsb.events'
+    path.write_bytes(b''.join(lines[:5]))
+    tracker(tmp_path).read(JOBS)
+
+    with open(path, 'ab') as f:
+        f.write(b''.join(lines[5:]))
+    # a restarted executor starts from the saved offset
+    assert tracker(tmp_path, replay=False).read(JOBS) == {
+        '103': {'JOBID': '103', 'STAT': 'PSUSP'},
+        '101': {'JOBID': '101', 'STAT': 'DONE'},
+        '102': {'JOBID': '102', 'STAT': 'EXIT'},
+    }
+
+def test_rotated_log_is_finished_first(tmp_path):
+    lines = event_lines()
+    path = tmp_path / 'lsb.events'
+    path.write_bytes(b''.join(lines[:5]))
+    events = tracker(tmp_path)
+    events.read(JOBS)
+
+    # events written before the rotation are read from lsb.events.0, then the new file
+    with open(path, 'ab') as f:
+        f.write(lines[5] + lines[6])
+    os.rename(path, tmp_path / 'lsb.events.0')
+    path.write_bytes(lines[0] + lines[7])
+
+    assert events.read(JOBS) == {
+        '103': {'JOBID': '103', 'STAT': 'PSUSP'},
+        '101': {'JOBID': '101', 'STAT': 'DONE'},
+        '102': {'JOBID': '102', 'STAT': 'EXIT'},
+    }
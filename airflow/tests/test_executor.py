@@ -0,0 +1,178 @@
+import json
+import time
+import types
+
+import pytest
+
+pytest.importorskip('airflow.executors.base_executor')
+
+from airflow.models.taskinstance import TaskInstanceKey
+from airflow.utils.state import State
+
+import lsf
+
+
+def task_key(task_id, run_id='manual__2022-01-13'):
+    return TaskInstanceKey(dag_id='process_text', task_id=task_id, run_id=run_id, try_number=1, map_index=-1)
+
+def task_command(key):
+    return ['airflow', 'tasks', 'run', key.dag_id, key.task_id, key.run_id, '--local']
+
+def sync_until(executor, done, timeout=10):
+    events = {}
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        executor.sync()
+        events.update(executor.get_event_buffer())
+        if done(events):
+            return events
+        time.sleep(0.05)
+
+    raise AssertionError(f'timed out with events {events}')
+
+@pytest.fixture
+def fake_lsf(monkeypatch):
+    monkeypatch.setenv('AIRFLOW__LSF__TRANSPORT', 'fake')
+    monkeypatch.setenv('AIRFLOW__LSF__BULK_SUBMIT', 'True')
+    # jobs are checked again soon in any status
+    monkeypatch.setenv('AIRFLOW__LSF__POLL_START_INTERVAL', '0.1')
+    monkeypatch.setenv('AIRFLOW__LSF__POLL_INTERVALS', 'PEND:0.1:0.1,RUN:0.1:0.1')
+
+@pytest.fixture
+def executor(fake_lsf):
+    executor = lsf.LSFExecutor()
+    executor.start()
+    executor.transport.run_time = 0.2
+    yield executor
+    executor.end()
+
+
+def test_new_jobs_are_checked_soon():
+    poller = lsf.PollScheduler(intervals=lsf.poll_intervals('pend:10:120, RUN:5:60'))
+    poller.add('1', 0)
+    checks = []
+    for _ in range(6):
+        now = poller.jobs['1'][2]
+        checks.append(now)
+        assert poller.due(now) == ['1']
+        poller.observe('1', 'PEND', now)
+
+    # at doubling ages, then by the interval of the status
+    assert checks == [0, 1, 2, 4, 8, 16]
+    assert poller.jobs['1'][2] == pytest.approx(16 + 10 + 1.6)
+
+def test_tasks_are_submitted_in_one_pack(executor):
+    keys = [task_key(f'task{i}') for i in range(3)]
+    for key in keys:
+        executor.running.add(key)
+        executor.execute_async(key, task_command(key))
+
+    events = sync_until(executor, lambda events: all(events.get(key, (None,))[0] == State.SUCCESS for key in keys))
+    assert executor.transport.next_jobid == 4
+    assert not executor.jobs
+    assert {key: events[key][0] for key in keys} == {key: State.SUCCESS for key in keys}
+
+def test_killed_job_fails_its_task(executor):
+    key = task_key('say_hi')
+    executor.transport.run_time = 60
+    executor.running.add(key)
+    executor.execute_async(key, task_command(key))
+    sync_until(executor, lambda events: executor.poller.count('RUN') == 1)
+
+    executor.transport.kill(list(executor.jobs))
+    events = sync_until(executor, lambda events: key in events and events[key][0] != State.QUEUED)
+    assert events[key][0] == State.FAILED
+
+def test_end_kills_tracked_jobs(monkeypatch):
+    monkeypatch.setenv('AIRFLOW__LSF__TRANSPORT', 'fake')
+    executor = lsf.LSFExecutor()
+    executor.start()
+    executor.transport.run_time = 60
+
+    key = task_key('wait_and_let_go')
+    executor.execute_async(key, task_command(key))
+    sync_until(executor, lambda events: executor.jobs)
+    executor.end()
+
+    assert not executor.jobs
+    assert executor.transport.status(['1'])['1']['STAT'] == 'EXIT'
+
+def test_task_is_adopted_by_job_name(executor):
+    key = task_key('say_hi')
+    jobid, = executor.transport.submit([(['-J', lsf.task_job_name(key)], task_command(key))])
+    other = task_key('the_end')
+
+    ti = types.SimpleNamespace(key=key, external_executor_id=None)
+    lost = types.SimpleNamespace(key=other, external_executor_id=None)
+    assert executor.try_adopt_task_instances([ti, lost]) == [lost]
+    assert executor.jobs == {jobid: key}
+    assert key in executor.running
+
+def test_restored_jobs_are_counted_once(fake_lsf, monkeypatch, tmp_path):
+    monkeypatch.setenv('AIRFLOW__LSF__REGISTRY', str(tmp_path / 'jobs.db'))
+    monkeypatch.setenv('AIRFLOW__LSF__MAX_PENDING_JOBS', '5')
+    first = lsf.LSFExecutor()
+    first.start()
+    first.transport.pend_time = 60
+    keys = [task_key(f'task{i}') for i in range(3)]
+    for key in keys:
+        first.execute_async(key, task_command(key))
+    sync_until(first, lambda events: len(first.jobs) == 3)
+    ids = {key: jid for jid, key in first.jobs.items()}
+    first.end()
+
+    # the restarted executor loads the jobs from the registry, then the scheduler adopts them.
+    # it is given the same fake LSF.
+    second = lsf.LSFExecutor()
+    second.transport = first.transport
+    second.start()
+    tis = [types.SimpleNamespace(key=key, external_executor_id=ids[key]) for key in keys]
+    assert second.try_adopt_task_instances(tis) == []
+    assert second.pending == {None: 3}
+    assert second.headroom() == 2
+
+    second.transport.pend_time = 0
+    sync_until(second, lambda events: not second.jobs)
+    assert sum(second.pending.values()) == 0
+    assert not any(second.poller.counts.values())
+    assert second.headroom() == 5
+    second.end()
+
+def test_executor_of_webserver_is_not_set_up(monkeypatch, tmp_path):
+    monkeypatch.setenv('AIRFLOW__LSF__TRANSPORT', 'pythonlsf')
+    monkeypatch.setenv('AIRFLOW__LSF__REGISTRY', str(tmp_path / 'missing' / 'jobs.db'))
+    executor = lsf.LSFExecutor()
+    assert executor.transport is None and executor.registry is None
+
+def test_right_sized_memory_is_in_mb(fake_lsf, monkeypatch):
+    monkeypatch.setenv('AIRFLOW__LSF__RIGHT_SIZE', 'True')
+    executor = lsf.LSFExecutor()
+    key = task_key('train')
+    for max_mem in (800, 1024, 900):
+        executor.history.add(key.dag_id, key.task_id, (max_mem, 90, 80))
+
+    options = executor.task_options(key, None, None)
+    assert lsf.option_value(options, '-M') == '1536MB'
+    assert lsf.option_value(options, '-R') == 'rusage[mem=1536MB]'
+    assert lsf.option_value(options, '-W') == '3'
+
+def test_unclaimed_eager_job_is_not_accounted(fake_lsf, monkeypatch):
+    monkeypatch.setenv('AIRFLOW__LSF__ACCOUNTING', 'True')
+    executor = lsf.LSFExecutor()
+    key = task_key('downstream')
+    executor.eager[lsf.task_ident(key)] = {'key': key, 'jobid': '7', 'claimed': None}
+    executor.eager_jobs['7'] = lsf.task_ident(key)
+    executor.track('7', key)
+
+    executor.process_status({'7': {'JOBID': '7', 'STAT': 'EXIT', 'EXIT_CODE': '1'}})
+    assert not executor.jobs and not executor.eager
+    assert executor.finished == {}
+
+@pytest.mark.parametrize('gpu, options', [
+    (True, ('-gpu', 'num=1')),
+    (False, ()),
+    (2, ('-gpu', 'num=2')),
+    ('num=2:mode=exclusive_process', ('-gpu', 'num=2:mode=exclusive_process')),
+])
+def test_gpu_options(gpu, options):
+    assert lsf.resource_options(json.dumps({'gpu': gpu})) == options
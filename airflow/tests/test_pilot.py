@@ -0,0 +1,27 @@
+import logging
+import os
+
+import pytest
+
+pytest.importorskip('airflow.executors.base_executor')
+
+import lsf
+
+log = logging.getLogger('test_pilot')
+
+
+def test_tasks_of_previous_scheduler_are_dropped(tmp_path):
+    pool = lsf.PilotPool(str(tmp_path), log)
+    pool.start()
+    pool.dispatch('queued', ['true'])
+    (tmp_path / 'done' / 'finished.json').write_text('{"rc": 0}')
+    pool.stop()
+
+    restarted = lsf.PilotPool(str(tmp_path), log)
+    restarted.start()
+    assert restarted.backlog() == 0
+    assert restarted.results() == []
+    assert not os.path.exists(tmp_path / 'stop')
+
+    restarted.dispatch('new', ['true'])
+    assert restarted.backlog() == 1
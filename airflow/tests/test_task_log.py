@@ -0,0 +1,47 @@
+import pytest
+
+pytest.importorskip('airflow.executors.base_executor')
+
+import lsf
+
+
+def test_appended_output_is_read(tmp_path):
+    path = tmp_path / 'attempt=1.log'
+    path.write_text('line 1\n')
+    logs = lsf.TaskLogCache(4)
+    assert logs.read(str(path)) == 'line 1\n'
+
+    with open(path, 'a') as f:
+        f.write('line 2\n')
+    assert logs.read(str(path)) == 'line 1\nline 2\n'
+
+    # a rewritten file is read again
+    path.write_text('retry\n')
+    assert logs.read(str(path)) == 'retry\n'
+
+def test_only_the_tail_of_a_large_file_is_kept(tmp_path):
+    path = tmp_path / 'attempt=1.log'
+    path.write_text(''.join(f'line {i}\n' for i in range(100)))
+    logs = lsf.TaskLogCache(4, max_file=64)
+
+    content = logs.read(str(path))
+    shown = content.split('\n', 1)[1]
+    assert content.startswith('[ LSF ] the first ')
+    assert shown.startswith('line ') and shown.endswith('line 99\n')
+    assert len(shown) <= 64
+
+    with open(path, 'a') as f:
+        f.write('line 100\n')
+    content = logs.read(str(path))
+    assert content.endswith('line 99\nline 100\n')
+    assert len(content.split('\n', 1)[1]) <= 64
+
+def test_cached_bytes_are_bounded(tmp_path):
+    logs = lsf.TaskLogCache(10, max_file=100, max_total=250)
+    for i in range(5):
+        path = tmp_path / f'{i}.log'
+        path.write_text('x' * 99 + '\n')
+        logs.read(str(path))
+
+    assert logs.total <= 250
+    assert list(logs.files) == [str(tmp_path / '3.log'), str(tmp_path / '4.log')]
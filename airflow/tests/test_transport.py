@@ -0,0 +1,35 @@
+import logging
+import os
+
+import pytest
+
+pytest.importorskip('airflow.executors.base_executor')
+
+import lsf
+
+SIMULATOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'simulator')
+log = logging.getLogger('test_transport')
+
+
+@pytest.fixture
+def simulator(monkeypatch, tmp_path):
+    monkeypatch.setenv('PATH', SIMULATOR + os.pathsep + os.environ['PATH'])
+    monkeypatch.setenv('LSF_SIM_STATE', str(tmp_path / 'lsfsim.db'))
+
+
+def test_jobs_are_submitted_in_one_pack(simulator):
+    transport = lsf.CLITransport(log, 30)
+    requests = [(['-J', f'job{i}'], ['sleep', '1']) for i in range(3)]
+    assert transport.submit(requests) == ['1', '2', '3']
+    assert transport.pack
+
+def test_jobs_are_submitted_one_by_one_without_packs(simulator, monkeypatch):
+    monkeypatch.setenv('LSF_SIM_PACK', '0')
+    transport = lsf.CLITransport(log, 30)
+    requests = [(['-J', f'job{i}'], ['sleep', '1']) for i in range(3)]
+    assert transport.submit(requests) == ['1', '2', '3']
+
+    # job packs are not tried again
+    assert not transport.pack
+    assert transport.submit(requests[:2]) == ['4', '5']
+    assert set(transport.status(['1', '5'], fields=('jobid', 'job_name'))) == {'1', '5'}
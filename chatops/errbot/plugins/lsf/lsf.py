@@ -12,48 +12,288 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import io
 import os
 import re
+import gzip
 import json
-import inspect
+import time
+import types
+import codecs
+import signal
+import selectors
+import collections
+import threading
 import subprocess
+from concurrent.futures import Future, ThreadPoolExecutor
 
 from errbot import BotPlugin, botcmd
 
+# job ids in one bjobs command line
+JOBID_CHUNK_SIZE = 1000
+
+# LSF commands run in a bounded pool of threads, and are killed after COMMAND_TIMEOUT seconds
+COMMAND_WORKERS = 8
+COMMAND_TIMEOUT = 60
+# output is sent in pages of PAGE_SIZE characters, at most STREAM_PAGES pages at once.
+# the rest is kept for `!more`, or uploaded as a file if it is longer than UPLOAD_SIZE.
+PAGE_SIZE = 3500
+STREAM_PAGES = 3
+FLUSH_INTERVAL = 2
+UPLOAD_SIZE = 64 * 1024
+MAX_OUTPUT = 1024 * 1024
+LARGE_OUTPUT = 16 * 1024 * 1024
+# outputs kept for `!more` are dropped after CURSOR_TTL seconds, the oldest first over MAX_CURSORS
+CURSOR_TTL = 600
+MAX_CURSORS = 32
+
+# seconds a job is watched at most
+WATCH_EXPIRY = 30 * 86400
+
+# kind of a watch condition -> bjobs fields it is evaluated with
+CONDITION_FIELDS = {
+    'finished': ('stat',),
+    'running': ('stat',),
+    'suspended': ('stat',),
+    'pending': ('stat', 'pend_time'),
+    'runtime': ('stat', 'run_time'),
+    'mem': ('stat', 'mem', 'memlimit'),
+    'array': ('stat',),
+}
+DEFAULT_CONDITIONS = (('finished', None),)
+CONDITION_USAGE = 'Conditions are `finished`, `running`, `suspended`, `pending>MINUTES`, `runtime>MINUTES`, `mem>PERCENT%` and `array=PERCENT,PERCENT`.'
+
+# seconds between checks of changes of config.json
+ACCESS_RELOAD_INTERVAL = 10
+
+default_reject_message = 'Error: you are not allowed to communicate with LSF'
+
+# execution policy of an LSF command:
+#   role: role of the users who can run it, see `roles` in config.json
+#   mutates: it changes LSF, its reply is never cached and its use is logged
+#   timeout: seconds before it is killed
+#   ttl: seconds its reply is shared by the users, not cached if 0
+#   limit: characters of output which are kept
+#   reject: reply to a user without the role
+#   binary: LSF command which is run, the name of the bot command if None
+Command = collections.namedtuple('Command', ['role', 'mutates', 'timeout', 'ttl', 'limit', 'reject', 'binary'],
+    defaults=['user', False, COMMAND_TIMEOUT, 0, MAX_OUTPUT, default_reject_message, None])
+
+# LSF commands which are run by `!<command> [args]`, generated as bot commands of the plugin
+COMMANDS = {
+    'lsid': Command(ttl=300),
+    'bjobs': Command(timeout=120, limit=LARGE_OUTPUT),
+    'bacct': Command(timeout=300, limit=LARGE_OUTPUT),
+    'bapp': Command(ttl=60),
+    'battr': Command(),
+    'bbot': Command(mutates=True),
+    'bchkpnt': Command(mutates=True),
+    'bclusters': Command(ttl=60),
+    'bdata': Command(mutates=True),
+    'bentags': Command(),
+    'bgadd': Command(mutates=True),
+    'bgdel': Command(mutates=True),
+    'bgmod': Command(mutates=True),
+    'bgpinfo': Command(),
+    'bhist': Command(timeout=300, limit=LARGE_OUTPUT),
+    'bhosts': Command(ttl=10),
+    'bhpart': Command(),
+    'bimages': Command(),
+    'bjdepinfo': Command(),
+    'bjgroup': Command(),
+    'bkill': Command(mutates=True),
+    'blcstat': Command(),
+    'blhosts': Command(),
+    'blimits': Command(ttl=10),
+    'blinfo': Command(),
+    'blkill': Command(mutates=True),
+    'blparams': Command(),
+    'blstat': Command(),
+    'bltasks': Command(),
+    'blusers': Command(),
+    'bmgroup': Command(ttl=60),
+    'bmig': Command(mutates=True),
+    'bmod': Command(mutates=True),
+    'bparams': Command(ttl=60),
+    'bpeek': Command(),
+    'bpost': Command(mutates=True),
+    'bqueues': Command(ttl=10),
+    'bread': Command(),
+    'brequeue': Command(mutates=True),
+    'bresize': Command(mutates=True),
+    'bresources': Command(ttl=10),
+    'brestart': Command(mutates=True),
+    'bresume': Command(mutates=True),
+    'brlainfo': Command(),
+    'brsvjob': Command(),
+    'brsvs': Command(),
+    'brsvsub': Command(mutates=True),
+    'bsla': Command(),
+    'bslots': Command(ttl=10),
+    'bstage': Command(mutates=True),
+    'bstatus': Command(),
+    'bstop': Command(mutates=True),
+    'bsub': Command(mutates=True),
+    'bswitch': Command(mutates=True),
+    'btop': Command(mutates=True),
+    'bugroup': Command(ttl=60),
+    'busers': Command(ttl=10),
+    'lsacct': Command(timeout=300, limit=LARGE_OUTPUT),
+    'lsclusters': Command(ttl=60),
+    'lshosts': Command(ttl=60),
+    'lsinfo': Command(ttl=300),
+    'lsload': Command(ttl=10),
+    'lsloadadj': Command(mutates=True),
+    'lsmake': Command(mutates=True),
+    'lspasswd': Command(mutates=True),
+    'badmin': Command(role='admin', mutates=True, reject='Error: you are not allowed to manage LSF'),
+    'bconf': Command(role='admin', mutates=True, reject='Error: you are not allowed to configure LSF'),
+    'brsvadd': Command(role='admin', mutates=True, reject='Error: you are not allowed to manage AR in LSF'),
+    'brsvdel': Command(role='admin', mutates=True, reject='Error: you are not allowed to manage AR in LSF'),
+    'brsvmod': Command(role='admin', mutates=True, reject='Error: you are not allowed to manage AR in LSF'),
+    'brun': Command(role='admin', mutates=True, reject='Error: you are not allowed to run a job forcely in LSF'),
+    'lsadmin': Command(role='admin', mutates=True, reject='Error: you are not allowed to manage LSF'),
+    'lsfshutdown': Command(role='admin', mutates=True, reject='Error: you are not allowed to shutdown LSF'),
+    'bladmin': Command(role='admin', mutates=True, reject='Error: you are not allowed to manage LS'),
+    'lsgrun': Command(role='admin', mutates=True, timeout=300, reject='Error: you are not allowed remote execution in LSF'),
+    'lsrun': Command(role='admin', mutates=True, timeout=300, reject='Error: you are not allowed remote execution in LSF'),
+}
+
 
 class LSF(BotPlugin):
     """
     LSF plugin supports talking with your LSF cluster
     """
 
-    config = None
+    # compiled config.json, None in non-security mode
+    access = None
+    # jobid -> watch of the job, {'user': user to notify, 'since': registration time, 'conditions': [(kind, value)]}
     jobs = {}
+    # bjobs field -> number of watched conditions which need it
+    fields = {}
+    # watches are changed since they are saved
+    dirty = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # user -> (expiry, output of the last command which is not sent completely), oldest first
+        self.cursors = collections.OrderedDict()
+        self.cursor_lock = threading.Lock()
+        # watches are changed by the poller and by commands, which run in other threads
+        self.watch_lock = threading.RLock()
 
     def monitor_jobs(self):
-        # TODO: perforamnce concern if too many jobs
-        for jobid, username in list(self.jobs.items()):
-            cmd = ['bjobs', '-o', 'STAT', '-noheader'] + [jobid]
-
-            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-            outs, _ = proc.communicate()
-            if len(outs) > 0:
-                status = outs.decode('utf-8').rstrip()
-                if status == 'DONE' or status == 'EXIT':
-                    del self.jobs[jobid]
-
-                    # for a user in a group, the user name is postfixed at the last `/`
-                    # get the user name and notify the user directly when job is finished
-                    start_pos = username.rfind('/')
-                    if start_pos >= 0:
-                        username = username[start_pos+1:]
-
-                    result = 'Notification: job <' + jobid + '> is ' + str(status)
-                    self.send(self.build_identifier('@' + username), f'\`\`\`{result}\`\`\`')
-
+        # all conditions of all registered jobs are checked against one snapshot,
+        # taken by one bjobs per chunk of job ids with the fields the conditions need
+        with self.watch_lock:
+            jobids = list(self.jobs)
+            fields = ['jobid'] + sorted(field for field, count in self.fields.items() if count > 0)
+        if not jobids:
+            return
+
+        snapshot = query_jobs(jobids, fields, self.log)
+
+        # notifications of a user in this cycle are sent in one message
+        notifications = {}
+        now = time.time()
+        with self.watch_lock:
+            for jobid in jobids:
+                watch = self.jobs.get(jobid)
+                records = snapshot.get(jobid)
+                if watch is None or records is None:
+                    continue
+
+                conditions = watch.get('conditions', DEFAULT_CONDITIONS)
+                if any('ERROR' in record for record in records):
+                    # the job is cleaned from LSF already
+                    results = ['is not found in LSF']
+                    remaining = []
+                else:
+                    results = []
+                    remaining = []
+                    for condition in conditions:
+                        result = check_condition(condition, records)
+                        if result:
+                            results.append(result)
+                        else:
+                            remaining.append(condition)
+
+                    # conditions which fire are not checked again, and a finished job is not watched anymore
+                    if all(record.get('STAT') in ('DONE', 'EXIT') for record in records):
+                        remaining = []
+                    elif now - watch.get('since', now) > WATCH_EXPIRY:
+                        results.append('is not watched anymore, it is not finished in ' + str(WATCH_EXPIRY // 86400) + ' days')
+                        remaining = []
+
+                if len(remaining) != len(conditions):
+                    self.unwatch(jobid)
+                    if remaining:
+                        self.watch(jobid, watch['user'], remaining, watch.get('since'))
+
+                for result in results:
+                    notifications.setdefault(notified_user(watch['user']), []).append('Notification: job <' + jobid + '> ' + result)
+
+        for username, results in notifications.items():
+            result = '\n'.join(results)
+            self.send(self.build_identifier('@' + username), f'\`\`\`{result}\`\`\`')
+
+        # changes of watches are saved once per cycle
+        self.save_watches()
+
+    def watch(self, jobid, user, conditions=DEFAULT_CONDITIONS, since=None):
+        with self.watch_lock:
+            self.unwatch(jobid)
+            self.jobs[jobid] = {'user': user, 'since': since or time.time(), 'conditions': list(conditions)}
+            self.index_fields(conditions, 1)
+            self.dirty = True
+
+    def unwatch(self, jobid):
+        with self.watch_lock:
+            watch = self.jobs.pop(jobid, None)
+            if watch is not None:
+                self.index_fields(watch.get('conditions', DEFAULT_CONDITIONS), -1)
+                self.dirty = True
+            return watch
+
+    def index_fields(self, conditions, delta):
+        # number of watched conditions which need each bjobs field
+        with self.watch_lock:
+            for condition in conditions:
+                for field in CONDITION_FIELDS[condition[0]]:
+                    self.fields[field] = self.fields.get(field, 0) + delta
+
+    def save_watches(self):
+        with self.watch_lock:
+            if self.dirty:
+                self.dirty = False
+                self['watches'] = dict(self.jobs)
 
     def activate(self):
         super().activate()
+        self.access = load_access(self.log)
+
+        # watches are kept in the plugin storage. jobs which are finished while
+        # the bot is down are notified by the first check.
+        with self.watch_lock:
+            self.jobs = {}
+            self.fields = {}
+            for jobid, watch in self.get('watches', {}).items():
+                self.watch(jobid, watch['user'], watch.get('conditions', DEFAULT_CONDITIONS), watch.get('since'))
+            self.dirty = False
+        if self.jobs:
+            self.log.info(f'{len(self.jobs)} job watches are loaded')
+            self.monitor_jobs()
+
         self.start_poller(5, self.monitor_jobs)
+        self.start_poller(ACCESS_RELOAD_INTERVAL, self.reload_access)
+
+    def deactivate(self):
+        self.save_watches()
+        super().deactivate()
+
+    def reload_access(self):
+        # config.json is compiled again when it is changed, and swapped in at once
+        self.access = load_access(self.log, self.access)
 
     ###########################################################################
     # command line without permission control
@@ -66,47 +306,46 @@ class LSF(BotPlugin):
     # command line allowed by users in allowlist
     ###########################################################################
     @botcmd(split_args_with=None)
-    def lsid(self, msg, args):
+    def register(self, msg, args):
         if not self.is_allowed(str(msg.frm)[1:]):
             return default_reject_message
 
-        cmd = ['lsid'] + args
-        return exec_LSF_cmd(cmd)
-
-    # TODO: register more notification conditions
-    @botcmd(split_args_with=None)
-    def register(self, msg, args):
+        if len(args) < 2:
+            return 'Registration failed. Usage: `!register [jobid] [@user] [condition ...]`'
         jobid = args[0]
         user = args[1]
 
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
         if not jobid.isnumeric():
             return 'Registration failed. Error: the job id is not valid'
         if not user.startswith('@'):
             return 'Registration failed. Error: the target user name should be prefixed with `@` '
 
-        # TODO: check if job is finished already
-        cmd = ['bjobs', '-o', 'JOBID', '-noheader'] + [jobid]
-        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        outs, _ = proc.communicate()
-        if len(outs) > 0:
-            jid = outs.decode('utf-8').rstrip()
-            if jid != jobid:
-                return 'Registration failed. Error: job <' + jobid + '> is not an existing job in LSF.'
-        self.jobs[jobid] = user
+        conditions = []
+        for arg in args[2:]:
+            try:
+                conditions.extend(parse_condition(arg))
+            except ValueError:
+                return 'Registration failed. Error: the condition `' + arg + '` is not valid. ' + CONDITION_USAGE
+        conditions = conditions or list(DEFAULT_CONDITIONS)
+
+        records = query_jobs([jobid], ['jobid', 'stat'], self.log).get(jobid)
+        if records is not None and any('ERROR' in record for record in records):
+            return 'Registration failed. Error: job <' + jobid + '> is not an existing job in LSF.'
+        # a job which is finished already is notified by the next check
+        self.watch(jobid, user, conditions)
 
         self.log.debug('register notification for job <' + jobid + '> to user ' + str(msg.frm))
 
-        result = 'Job <' + jobid + '> is registered to be notified <' + user[1:] + '> when it is finished.'
+        result = 'Job <' + jobid + '> is registered to be notified <' + user[1:] + '> when ' + ', '.join(describe_condition(c) for c in conditions) + '.'
         return f'\`\`\`{result}\`\`\`'
 
     @botcmd(split_args_with=None)
     def bsub(self, msg, args):
+        # bsub of the command table, run with the mapped user. its job is watched.
+        command = COMMANDS['bsub']
         username = str(msg.frm)[1:]
-        if not self.is_allowed(username):
-            return default_reject_message
+        if not self.has_role(username, command.role):
+            return command.reject
 
         for arg in args:
             if arg.startswith('-user'):
@@ -114,691 +353,520 @@ class LSF(BotPlugin):
 
         realuser = self.get_mapped_user(username)
         if realuser != username:
-            cmd = ['bsub', '-user', realuser] + args
+            cmd = [command.binary or 'bsub', '-user', realuser] + args
         else:
-            cmd = ['bsub'] + args
+            cmd = [command.binary or 'bsub'] + args
 
-        message = exec_LSF_cmd(cmd)
+        if command.mutates:
+            self.log.info(f'{username} runs bsub {" ".join(args)}')
+        self.pop_cursor(str(msg.frm))
+        message = exec_LSF_cmd(cmd, command)
 
         # record job information for monitoring
         result = re.search(r'<(\d*)>', message)
         if result:
             jobid = result.group(1)
-            self.jobs[jobid] = str(msg.frm)
+            self.watch(jobid, str(msg.frm))
 
         return message
 
-    @botcmd(split_args_with=None)
-    def bjobs(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        # TODO: maybe more access control to query jobs
-        cmd = ['bjobs'] + args
-        return exec_LSF_cmd(cmd)
-
-    # TODO: optimize code
-    @botcmd(split_args_with=None)
-    def bacct(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bapp(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def battr(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bbot(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bchkpnt(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bclusters(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bdata(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bentags(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bgadd(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bgdel(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bgmod(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bgpinfo(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bhist(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bhosts(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bhpart(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bimages(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bjdepinfo(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bjgroup(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bkill(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def blcstat(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def blhosts(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def blimits(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def blinfo(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def blkill(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def blparams(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def blstat(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bltasks(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def blusers(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bmgroup(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bmig(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bmod(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bparams(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bpeek(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bpost(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bqueues(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bread(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def brequeue(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bresize(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bresources(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def brestart(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bresume(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def brlainfo(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def brsvjob(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def brsvs(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def brsvsub(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bsla(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bslots(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bstage(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bstatus(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bstop(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bswitch(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def btop(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bugroup(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def busers(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def lsacct(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def lsclusters(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def lshosts(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def lsinfo(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def lsload(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def lsloadadj(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def lsmake(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def lspasswd(self, msg, args):
-        if not self.is_allowed(str(msg.frm)[1:]):
-            return default_reject_message
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
     ###########################################################################
-    # command line allowed by the administrator user
+    # LSF commands of the command table
     ###########################################################################
-    @botcmd(split_args_with=None)
-    def badmin(self, msg, args):
-        if not self.is_admin(str(msg.frm)[1:]):
-            return 'Error: you are not allowed to manage LSF'
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bconf(self, msg, args):
-        if not self.is_admin(str(msg.frm)[1:]):
-            return 'Error: you are not allowed to configure LSF'
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def brsvadd(self, msg, args):
-        if not self.is_admin(str(msg.frm)[1:]):
-            return 'Error: you are not allowed to manage AR in LSF'
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def brsvdel(self, msg, args):
-        if not self.is_admin(str(msg.frm)[1:]):
-            return 'Error: you are not allowed to manage AR in LSF'
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def brsvmod(self, msg, args):
-        if not self.is_admin(str(msg.frm)[1:]):
-            return 'Error: you are not allowed to manage AR in LSF'
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def brun(self, msg, args):
-        if not self.is_admin(str(msg.frm)[1:]):
-            return 'Error: you are not allowed to run a job forcely in LSF'
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def lsadmin(self, msg, args):
-        if not self.is_admin(str(msg.frm)[1:]):
-            return 'Error: you are not allowed to manage LSF'
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def lsfshutdown(self, msg, args):
-        if not self.is_admin(str(msg.frm)[1:]):
-            return 'Error: you are not allowed to shutdown LSF'
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def bladmin(self, msg, args):
-        if not self.is_admin(str(msg.frm)[1:]):
-            return 'Error: you are not allowed to manage LS'
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def lsgrun(self, msg, args):
-        if not self.is_admin(str(msg.frm)[1:]):
-            return 'Error: you are not allowed remote execution in LSF'
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
-
-    @botcmd(split_args_with=None)
-    def lsrun(self, msg, args):
-        if not self.is_admin(str(msg.frm)[1:]):
-            return 'Error: you are not allowed remote execution in LSF'
-
-        cmd = [inspect.getframeinfo(inspect.currentframe()).function] + args
-        return exec_LSF_cmd(cmd)
+    def run_LSF_command(self, msg, args, name, command):
+        user = str(msg.frm)[1:]
+        if not self.has_role(user, command.role):
+            yield command.reject
+            return
+
+        if command.mutates:
+            self.log.info(f'{user} runs {name} {" ".join(args)}')
+        yield from self.reply_LSF_cmd(msg, [command.binary or name] + args, command)
+
+    def reply_LSF_cmd(self, msg, cmd, command=None):
+        # the output is sent in pages as it is printed. the rest of a long output
+        # is kept for `!more`, or uploaded as a file when the command is finished.
+        self.pop_cursor(str(msg.frm))
+        output = start_LSF_cmd(cmd, command)
+        for _ in range(STREAM_PAGES):
+            page = output.page(PAGE_SIZE, FLUSH_INTERVAL)
+            if page is None:
+                return
+            yield f'\`\`\`{page}\`\`\`'
+
+        if output.exhausted(FLUSH_INTERVAL):
+            return
+
+        if output.done and output.buffered > UPLOAD_SIZE:
+            self.upload_output(msg, output)
+            return
+
+        self.keep_cursor(str(msg.frm), output)
+        yield 'There is more output. Use `!more` for the next page, or `!more file` for the rest as a file.'
+
+    @botcmd(split_args_with=None)
+    def more(self, msg, args):
+        output = self.pop_cursor(str(msg.frm))
+        if output is None:
+            yield 'There is no more output'
+            return
+
+        if args and args[0] == 'file':
+            self.upload_output(msg, output)
+            return
+
+        page = output.page(PAGE_SIZE, FLUSH_INTERVAL)
+        if page is not None:
+            yield f'\`\`\`{page}\`\`\`'
+        if not output.exhausted(FLUSH_INTERVAL):
+            self.keep_cursor(str(msg.frm), output)
+
+    def keep_cursor(self, user, output):
+        with self.cursor_lock:
+            now = time.monotonic()
+            for key in [key for key, (expiry, _) in self.cursors.items() if expiry <= now]:
+                del self.cursors[key]
+            self.cursors.pop(user, None)
+            self.cursors[user] = (now + CURSOR_TTL, output)
+            while len(self.cursors) > MAX_CURSORS:
+                self.cursors.popitem(last=False)
+
+    def pop_cursor(self, user):
+        # the output kept for the user, None if there is none or it is expired
+        with self.cursor_lock:
+            expiry, output = self.cursors.pop(user, (0, None))
+        return output if expiry > time.monotonic() else None
+
+    def upload_output(self, msg, output):
+        data = gzip.compress(output.read().encode('utf-8'))
+        to = msg.to if getattr(msg, 'is_group', False) else msg.frm
+        self.send_stream_request(to, io.BytesIO(data), name='lsf-output.txt.gz', size=len(data), stream_type='application/gzip')
 
     ###########################################################################
     # permission checking functions
     ###########################################################################
-    def is_admin(self, user):
-        if self.config == None:
-           self.config = load_config(self.log)
-
+    def has_role(self, user, role):
         # none security mode: allows everyone to execute LSF command
-        if self.config == None:
-            return True
-
-        if 'administrator' in self.config:
-            return user == self.config['administrator']
-
-        return False
+        access = self.access
+        return access is None or access.has_role(user, role)
 
     def is_allowed(self, user):
-        if self.config == None:
-           self.config = load_config(self.log)
-
         # none security mode: allows everyone to execute LSF command
-        if self.config == None:
-            return True
-
-        if 'administrator' in self.config:
-            return user == self.config['administrator']
-
-        if 'allowlist' in self.config:
-            return user in self.config['allowlist']
-
-        return False
+        access = self.access
+        return access is None or access.has_role(user, 'user')
 
     def get_mapped_user(self, user):
-        if self.config == None:
-           self.config = load_config(self.log)
+        # none security mode, or no mapped user: uses submission user
+        access = self.access
+        return user if access is None else access.mapped_user(user)
 
-        # none security mode: uses submission user
-        if self.config == None:
-            return user
 
-        if 'usermap' in self.config:
-            for usermap in self.config['usermap']:
-                if user in usermap:
-                    return usermap[user]
+def LSF_command(name, command):
+    def run(self, msg, args):
+        yield from self.run_LSF_command(msg, args, name, command)
 
-        # if there is no mapped user, use submission user
-        return user
+    run.__name__ = name
+    run.__doc__ = f'runs `{name}` of LSF'
+    return botcmd(split_args_with=None)(run)
 
+def add_LSF_commands(plugin):
+    # bot commands of the command table are added when the plugin is loaded,
+    # except the commands which the plugin defines itself
+    for name, command in COMMANDS.items():
+        if name not in vars(plugin):
+            setattr(plugin, name, LSF_command(name, command))
+
+add_LSF_commands(LSF)
 
 # helper functions
-def exec_LSF_cmd(cmd):
-    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    try:
-        outs, errs = proc.communicate(timeout=5)
-    except TimeoutExpired:
-        proc.kill()
-        outs, errs = proc.communicate()
+def notified_user(username):
+    # for a user in a group, the user name is postfixed at the last `/`
+    # get the user name and notify the user directly when job is finished
+    start_pos = username.rfind('/')
+    if start_pos >= 0:
+        username = username[start_pos+1:]
+
+    return username.lstrip('@')
+
+def query_jobs(jobids, fields, log, timeout=30):
+    # returns {jobid: [bjobs -json records]}, one record per element of a job array,
+    # with an 'ERROR' in the record of a job unknown by LSF. jobs of a chunk which
+    # fails to be queried are not in the result.
+    records = {}
+    for i in range(0, len(jobids), JOBID_CHUNK_SIZE):
+        cmd = ['bjobs', '-o', ' '.join(fields), '-json'] + jobids[i:i + JOBID_CHUNK_SIZE]
+        try:
+            outs = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=timeout).stdout
+        except (OSError, subprocess.TimeoutExpired) as e:
+            log.warning(f'failed to query jobs: {e}')
+            continue
+
+        # stderr is merged into stdout, skip any message before the json document
+        reply = outs.decode('utf-8')
+        try:
+            for record in json.loads(reply[reply.index('{'):]).get('RECORDS', []):
+                if 'JOBID' in record:
+                    records.setdefault(record['JOBID'], []).append(record)
+        except ValueError:
+            log.warning(f'failed to parse bjobs reply: {reply}')
+
+    return records
+
+def parse_condition(text):
+    # returns the conditions of one argument of !register, raises ValueError
+    if text in ('finished', 'running', 'suspended'):
+        return [(text, None)]
+
+    matched = re.fullmatch(r'(pending|runtime)>(\d+)m?', text)
+    if matched:
+        return [(matched.group(1), int(matched.group(2)) * 60)]
+    matched = re.fullmatch(r'mem>(\d+)%?', text)
+    if matched:
+        return [('mem', int(matched.group(1)))]
+    matched = re.fullmatch(r'array=(\d+(?:,\d+)*)%?', text)
+    if matched:
+        milestones = sorted(set(int(p) for p in matched.group(1).split(',')))
+        if milestones[-1] > 100:
+            raise ValueError(text)
+        return [('array', p) for p in milestones]
+    raise ValueError(text)
+
+
+def describe_condition(condition):
+    kind, value = condition
+    if kind == 'finished':
+        return 'it is finished'
+    if kind in ('running', 'suspended'):
+        return 'it is ' + kind
+    if kind == 'pending':
+        return f'it is pending for more than {value // 60} minutes'
+    if kind == 'runtime':
+        return f'it runs for more than {value // 60} minutes'
+    if kind == 'mem':
+        return f'it uses more than {value}% of its memory limit'
+    return f'{value}% of its array elements are finished'
+
+
+def check_condition(condition, records):
+    # returns the notification of a condition met by the records of a job, or None
+    kind, value = condition
+    stats = [record.get('STAT') for record in records]
+    if kind == 'finished':
+        if all(stat in ('DONE', 'EXIT') for stat in stats):
+            if len(stats) == 1:
+                return 'is ' + stats[0]
+            return f'is finished, {stats.count("DONE")} elements are DONE and {stats.count("EXIT")} are EXIT'
+    elif kind == 'running':
+        if any(stat == 'RUN' for stat in stats):
+            return 'is running'
+    elif kind == 'suspended':
+        suspended = [stat for stat in stats if stat in ('PSUSP', 'USUSP', 'SSUSP')]
+        if suspended:
+            return 'is suspended (' + suspended[0] + ')'
+    elif kind == 'pending':
+        pending = [seconds(record.get('PEND_TIME')) for record in records if record.get('STAT') == 'PEND']
+        if pending and max(pending) > value:
+            return f'is pending for more than {value // 60} minutes'
+    elif kind == 'runtime':
+        running = [seconds(record.get('RUN_TIME')) for record in records if record.get('STAT') == 'RUN']
+        if running and max(running) > value:
+            return f'runs for more than {value // 60} minutes'
+    elif kind == 'mem':
+        for record in records:
+            mem = memory_mb(record.get('MEM'))
+            limit = memory_mb(record.get('MEMLIMIT'))
+            if record.get('STAT') == 'RUN' and mem is not None and limit and mem * 100 > limit * value:
+                return f'uses {mem * 100 // limit:.0f}% of its memory limit'
+    elif kind == 'array':
+        finished = sum(1 for stat in stats if stat in ('DONE', 'EXIT'))
+        if finished * 100 >= len(stats) * value:
+            return f'has {value}% of its array elements finished ({finished}/{len(stats)})'
+    return None
+
+
+def seconds(value):
+    # bjobs reports times like '120', '120 second(s)', or '-' when unknown
+    matched = re.match(r'\s*(\d+)', value or '')
+    return int(matched.group(1)) if matched else 0
+
+
+def memory_mb(value):
+    # bjobs reports memory like '512 Mbytes' or '2 G', MB without a unit; None when unknown
+    matched = re.match(r'\s*([\d.]+)\s*([KMGT]?)', value or '', re.IGNORECASE)
+    if not matched:
+        return None
+    scale = {'K': 1 / 1024, '': 1, 'M': 1, 'G': 1024, 'T': 1024 * 1024}[matched.group(2).upper()]
+    return float(matched.group(1)) * scale
 
-    result = outs.decode('utf-8')
 
-    return f'\`\`\`{result}\`\`\`'
+class ReplyCache:
+    """
+    replies of read-only LSF commands for a few seconds. a command which is
+    already running for another user is waited for instead of run again.
+    """
+
+    def __init__(self, size=256):
+        self.size = size
+        self.lock = threading.Lock()
+        # command -> (expire time, reply)
+        self.replies = {}
+        # command -> future of its reply
+        self.running = {}
+
+    def get(self, cmd, ttl, run):
+        key = tuple(cmd)
+        with self.lock:
+            entry = self.replies.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                return entry[1]
+
+            future = self.running.get(key)
+            if future is not None:
+                owner = False
+            else:
+                future = self.running[key] = Future()
+                owner = True
+
+        if not owner:
+            return future.result()
+
+        try:
+            reply = run(cmd)
+        except Exception as e:
+            with self.lock:
+                del self.running[key]
+            future.set_exception(e)
+            raise
+
+        with self.lock:
+            del self.running[key]
+            self.add(key, time.monotonic() + ttl, reply)
+        future.set_result(reply)
+        return reply
+
+    def add(self, key, expire, reply):
+        if len(self.replies) >= self.size:
+            now = time.monotonic()
+            self.replies = {k: v for k, v in self.replies.items() if v[0] > now}
+            if len(self.replies) >= self.size:
+                self.replies.pop(next(iter(self.replies)))
+        self.replies[key] = (expire, reply)
+
+reply_cache = ReplyCache()
+command_pool = ThreadPoolExecutor(max_workers=COMMAND_WORKERS, thread_name_prefix='lsf-cmd')
+
+def exec_LSF_cmd(cmd, command=None):
+    return f'\`\`\`{start_LSF_cmd(cmd, command).read()}\`\`\`'
+
+def start_LSF_cmd(cmd, command=None):
+    command = command or COMMANDS.get(cmd[0]) or Command()
+    output = CommandOutput(command.limit)
+
+    # replies of read-only commands are shared for a while, others always run
+    if command.ttl and not command.mutates:
+        output.write(reply_cache.get(cmd, command.ttl, lambda cmd: run_LSF_cmd(cmd, command)))
+        output.close()
+        return output
+
+    command_pool.submit(read_LSF_cmd, cmd, output, command.timeout)
+    return output
+
+def run_LSF_cmd(cmd, command):
+    output = CommandOutput(command.limit)
+    command_pool.submit(read_LSF_cmd, cmd, output, command.timeout)
+    return output.read()
+
+def read_LSF_cmd(cmd, output, timeout):
+    # runs in the worker pool, the output is passed on as it is printed. the command
+    # runs in its own session, so that the processes it starts are killed with it.
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, start_new_session=True)
+    except OSError as e:
+        output.close(f'Error: failed to run {cmd[0]}: {e}')
+        return
+
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    deadline = time.monotonic() + timeout
+    message = None
+    with selectors.DefaultSelector() as selector:
+        selector.register(proc.stdout, selectors.EVENT_READ)
+        while True:
+            # the pipe is given up at the timeout, even if a process keeps it open
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not selector.select(remaining):
+                message = f'Error: {cmd[0]} is timed out after {timeout} seconds'
+                break
+
+            data = os.read(proc.stdout.fileno(), 65536)
+            if not output.write(decoder.decode(data, final=not data)):
+                message = f'Error: the output is truncated at {output.limit} characters'
+                break
+            if not data:
+                break
+
+    if message is None:
+        try:
+            proc.wait(max(0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            message = f'Error: {cmd[0]} is timed out after {timeout} seconds'
+    if message is not None:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    proc.stdout.close()
+    proc.wait()
+    output.close(message)
+
+
+class CommandOutput:
+    """
+    output of a command which is being read. pages are taken from the start
+    of the output while the rest is still printed.
+    """
 
-def load_config(log):
+    def __init__(self, limit=MAX_OUTPUT):
+        self.limit = limit
+        self.cond = threading.Condition()
+        self.lines = collections.deque()
+        # characters not taken yet, and all characters written
+        self.buffered = 0
+        self.size = 0
+        self.done = False
+
+    def write(self, text):
+        # returns False when the output is over its limit
+        if not text:
+            return self.size < self.limit
+
+        with self.cond:
+            self.lines.append(text)
+            self.buffered += len(text)
+            self.size += len(text)
+            self.cond.notify_all()
+            return self.size < self.limit
+
+    def close(self, message=None):
+        with self.cond:
+            if message:
+                self.lines.append(message + '\n')
+                self.buffered += len(message) + 1
+            self.done = True
+            self.cond.notify_all()
+
+    def page(self, size, wait):
+        # waits for a full page, or for the end of the command, or at most `wait`
+        # seconds once some output is printed. None if there is no more output.
+        with self.cond:
+            deadline = time.monotonic() + wait
+            while not self.done and self.buffered < size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    if self.lines:
+                        break
+                    deadline = time.monotonic() + wait
+                    remaining = wait
+                self.cond.wait(remaining)
+
+            if not self.lines:
+                return None
+
+            taken = []
+            length = 0
+            while self.lines and length < size:
+                line = self.lines.popleft()
+                if length + len(line) > size and taken:
+                    self.lines.appendleft(line)
+                    break
+                if len(line) > size:
+                    # a line longer than a page is split
+                    self.lines.appendleft(line[size:])
+                    line = line[:size]
+                taken.append(line)
+                length += len(line)
+
+            self.buffered -= length
+            return ''.join(taken)
+
+    def read(self):
+        # the rest of the output once the command is finished
+        with self.cond:
+            while not self.done:
+                self.cond.wait()
+
+            text = ''.join(self.lines)
+            self.lines.clear()
+            self.buffered = 0
+            return text
+
+    def exhausted(self, wait=0):
+        # waits at most `wait` seconds for more output or the end of the command
+        with self.cond:
+            self.cond.wait_for(lambda: self.done or self.lines, wait)
+            return self.done and not self.lines
+
+def load_access(log, current=None):
+    # returns the compiled config.json, or the current one if the file is not changed
     path = os.getenv('LSF_PLUGIN_TOP')
     if path is None:
-        log.debug('LSF chatops robot is running in non-security mode')
+        if current is None:
+            log.debug('LSF chatops robot is running in non-security mode')
         return None
 
-    log.debug('LSF chatops robot is running in security mode')
-
     cfile = os.path.join(path, 'config.json')
-    with open(cfile) as f:
-        config = json.load(f)
+    try:
+        mtime = os.stat(cfile).st_mtime_ns
+        if current is not None and current.mtime == mtime:
+            return current
 
-    return config
+        with open(cfile) as f:
+            access = AccessIndex(json.load(f), mtime)
+    except (OSError, ValueError) as e:
+        # a broken config.json does not open access to everyone
+        log.error(f'failed to load {cfile}: {e}')
+        return current if current is not None else AccessIndex({})
 
-default_reject_message = 'Error: you are not allowed to communicate with LSF'
+    log.info(f'LSF chatops robot is running in security mode with {cfile}')
+    return access
+
+
+class AccessIndex:
+    """
+    access rules of config.json compiled for lookups by user. members of
+    `groups` are expanded in `administrator`, `allowlist` and `roles` by `group:<name>`.
+    """
+
+    def __init__(self, config, mtime=None):
+        self.mtime = mtime
+        self.groups = {name: frozenset(members) for name, members in config.get('groups', {}).items()}
+
+        roles = {role: self.expand(members) for role, members in config.get('roles', {}).items()}
+        roles['admin'] = roles.get('admin', frozenset()) | self.expand(config.get('administrator', []))
+        # users of any role can talk with LSF
+        roles['user'] = frozenset().union(self.expand(config.get('allowlist', [])), *roles.values())
+        self.roles = types.MappingProxyType(roles)
+
+        # usermap is a dict of slack user -> os user, or a list of such dicts
+        usermap = config.get('usermap', {})
+        if isinstance(usermap, list):
+            usermap = {user: osuser for entry in usermap for user, osuser in entry.items()}
+        self.usermap = types.MappingProxyType(dict(usermap))
+
+    def expand(self, entries):
+        if isinstance(entries, str):
+            entries = [entries]
+
+        users = set()
+        for entry in entries:
+            if entry.startswith('group:'):
+                users.update(self.groups.get(entry[len('group:'):], ()))
+            else:
+                users.add(entry)
+
+        return frozenset(users)
+
+    def has_role(self, user, role):
+        return user in self.roles.get(role, ())
+
+    def mapped_user(self, user):
+        return self.usermap.get(user, user)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# lsf.py is imported the way errbot imports it from its plugins directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'plugins', 'lsf'))
@@ -0,0 +1,45 @@
+import sys
+import types
+from unittest import mock
+
+import pytest
+
+pytest.importorskip('errbot')
+
+import lsf
+
+
+@pytest.fixture
+def plugin():
+    plugin = lsf.LSF(mock.MagicMock())
+    plugin.jobs = {}
+    plugin.fields = {}
+    return plugin
+
+@pytest.fixture
+def msg():
+    return types.SimpleNamespace(frm='@alice', to='@lsfbot', is_group=False)
+
+
+def test_bot_commands_of_the_table():
+    assert all(callable(getattr(lsf.LSF, name)) for name in lsf.COMMANDS)
+    # the plugin keeps its own bsub, and the table is added without module globals
+    assert lsf.LSF.bsub.__doc__ != 'runs `bsub` of LSF'
+    assert 'name' not in vars(lsf) and 'command' not in vars(lsf)
+
+def test_command_runs_its_binary(plugin, msg, monkeypatch):
+    monkeypatch.setitem(lsf.COMMANDS, 'pyversion', lsf.Command(binary=sys.executable))
+    run = lsf.LSF_command('pyversion', lsf.COMMANDS['pyversion'])
+    replies = list(run(plugin, msg, ['-c', 'print("ran")']))
+    assert replies == ['\\`\\`\\`ran\n\\`\\`\\`']
+
+def test_bsub_follows_its_entry(plugin, msg, monkeypatch):
+    fake_bsub = [sys.executable, '-c', 'print("Job <42> is submitted to default queue <normal>.")']
+    monkeypatch.setitem(lsf.COMMANDS, 'bsub', lsf.Command(mutates=True, binary=fake_bsub[0]))
+    reply = plugin.bsub(msg, fake_bsub[1:])
+    assert 'Job <42> is submitted' in reply
+    assert plugin.jobs['42']['user'] == '@alice'
+
+    monkeypatch.setitem(lsf.COMMANDS, 'bsub', lsf.Command(role='admin', reject='Error: no jobs for you'))
+    plugin.access = mock.Mock(has_role=lambda user, role: role == 'user')
+    assert plugin.bsub(msg, ['sleep', '1']) == 'Error: no jobs for you'
@@ -0,0 +1,73 @@
+import sys
+import types
+from unittest import mock
+
+import pytest
+
+pytest.importorskip('errbot')
+
+import lsf
+
+# replies are fenced as in the plugin
+FENCE = '\\`\\`\\`'
+MORE = 'There is more output. Use `!more` for the next page, or `!more file` for the rest as a file.'
+
+
+def printing(size):
+    # a command which prints `size` characters with the new line
+    return [sys.executable, '-c', f'print("x" * {size - 1})']
+
+def page_sizes(replies):
+    return [len(reply) - 2 * len(FENCE) if reply.startswith(FENCE) else reply for reply in replies]
+
+@pytest.fixture
+def plugin():
+    return lsf.LSF(mock.MagicMock())
+
+@pytest.fixture
+def msg():
+    return types.SimpleNamespace(frm='@alice', to='@lsfbot', is_group=False)
+
+
+def test_output_of_one_page(plugin, msg):
+    replies = list(plugin.reply_LSF_cmd(msg, printing(lsf.PAGE_SIZE), lsf.Command()))
+    assert page_sizes(replies) == [lsf.PAGE_SIZE]
+
+def test_output_of_streamed_pages(plugin, msg):
+    size = lsf.PAGE_SIZE * lsf.STREAM_PAGES
+    replies = list(plugin.reply_LSF_cmd(msg, printing(size), lsf.Command()))
+    assert page_sizes(replies) == [lsf.PAGE_SIZE] * lsf.STREAM_PAGES
+    assert list(plugin.more(msg, [])) == ['There is no more output']
+
+def test_empty_output(plugin, msg):
+    replies = list(plugin.reply_LSF_cmd(msg, [sys.executable, '-c', ''], lsf.Command()))
+    assert replies == []
+
+def test_rest_of_output_by_more(plugin, msg):
+    size = lsf.PAGE_SIZE * (lsf.STREAM_PAGES + 1) + 10
+    replies = list(plugin.reply_LSF_cmd(msg, printing(size), lsf.Command()))
+    assert page_sizes(replies) == [lsf.PAGE_SIZE] * lsf.STREAM_PAGES + [MORE]
+
+    assert page_sizes(plugin.more(msg, [])) == [lsf.PAGE_SIZE]
+    assert page_sizes(plugin.more(msg, [])) == [10]
+    assert list(plugin.more(msg, [])) == ['There is no more output']
+
+def test_new_command_replaces_the_cursor(plugin, msg):
+    size = lsf.PAGE_SIZE * (lsf.STREAM_PAGES + 1)
+    list(plugin.reply_LSF_cmd(msg, printing(size), lsf.Command()))
+    assert str(msg.frm) in plugin.cursors
+
+    # `!more` after a short output does not continue the long one
+    assert page_sizes(plugin.reply_LSF_cmd(msg, printing(10), lsf.Command())) == [10]
+    assert list(plugin.more(msg, [])) == ['There is no more output']
+
+def test_cursors_are_bounded(plugin, msg, monkeypatch):
+    monkeypatch.setattr(lsf, 'MAX_CURSORS', 2)
+    for user in ('@alice', '@bob', '@carol'):
+        plugin.keep_cursor(user, lsf.CommandOutput())
+    assert list(plugin.cursors) == ['@bob', '@carol']
+
+    # an expired output is not continued
+    monkeypatch.setattr(lsf, 'CURSOR_TTL', 0)
+    plugin.keep_cursor('@dave', lsf.CommandOutput())
+    assert list(plugin.more(types.SimpleNamespace(frm='@dave', to='@lsfbot'), [])) == ['There is no more output']
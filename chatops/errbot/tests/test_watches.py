@@ -0,0 +1,41 @@
+import threading
+from unittest import mock
+
+import pytest
+
+pytest.importorskip('errbot')
+
+import lsf
+
+
+@pytest.fixture
+def plugin():
+    plugin = lsf.LSF(mock.MagicMock())
+    plugin.jobs = {}
+    plugin.fields = {}
+    return plugin
+
+def finished_jobs(jobids, fields, log):
+    # odd jobs are finished, even jobs are running
+    return {jobid: [{'JOBID': jobid, 'STAT': 'DONE' if int(jobid) % 2 else 'RUN'}] for jobid in jobids}
+
+
+def test_watches_are_changed_by_commands_and_poller(plugin, monkeypatch):
+    monkeypatch.setattr(lsf, 'query_jobs', finished_jobs)
+    monkeypatch.setattr(plugin, 'send', lambda to, text: None, raising=False)
+    monkeypatch.setattr(plugin, 'save_watches', lambda: None)
+
+    def register(first):
+        for jobid in range(first, first + 500):
+            plugin.watch(str(jobid), 'alice', [('finished', None), ('runtime', 60)])
+
+    threads = [threading.Thread(target=register, args=(i * 500,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads):
+        plugin.monitor_jobs()
+    plugin.monitor_jobs()
+
+    # only the running jobs are watched, and the field index counts their conditions
+    assert sorted(plugin.jobs, key=int) == [str(jobid) for jobid in range(0, 2000, 2)]
+    assert plugin.fields == {'stat': 2000, 'run_time': 1000}